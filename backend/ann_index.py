@@ -0,0 +1,176 @@
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Rows scored per chunk when assigning vectors to lists, to bound temporary memory
+ASSIGN_CHUNK_SIZE = 65536
+
+
+def kmeans(
+    data: np.ndarray,
+    n_clusters: int,
+    n_iter: int = 20,
+    sample_size: int = 100000,
+    seed: int = 0,
+    init_centroids: Optional[np.ndarray] = None,
+    spherical: bool = True,
+) -> np.ndarray:
+    """
+    k-means on a random sample of the data. Spherical (cosine similarity, unit-norm centroids) by default,
+    plain Euclidean k-means with spherical=False (used for product-quantization sub-vectors).
+    """
+    rng = np.random.default_rng(seed)
+    if len(data) > sample_size:
+        sample = np.asarray(data[np.sort(rng.choice(len(data), sample_size, replace=False))], dtype=np.float32)
+    else:
+        sample = np.asarray(data, dtype=np.float32)
+
+    n_clusters = min(n_clusters, len(sample))
+    if init_centroids is not None and len(init_centroids) == n_clusters:
+        centroids = np.array(init_centroids, dtype=np.float32)
+    else:
+        centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = assign_to_centroids(sample, centroids, euclidean=not spherical)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Per-cluster sums via one sorted pass (much faster than np.add.at on large samples)
+        order = np.argsort(assignments, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        new_centroids = np.zeros_like(centroids)
+        new_centroids[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        if not spherical:
+            new_centroids /= np.maximum(counts, 1)[:, None]
+
+        # Re-seed empty clusters with random points so every list stays in use
+        empty = counts == 0
+        if empty.any():
+            new_centroids[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+
+        if spherical:
+            norms = np.linalg.norm(new_centroids, axis=1, keepdims=True)
+            centroids = new_centroids / np.maximum(norms, 1e-12)
+        else:
+            centroids = new_centroids
+
+    return centroids
+
+
+def assign_to_centroids(data: np.ndarray, centroids: np.ndarray, euclidean: bool = False) -> np.ndarray:
+    """Index of the most similar (or, with euclidean=True, the nearest) centroid for every row"""
+    # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    bias = -0.5 * np.sum(centroids * centroids, axis=1) if euclidean else None
+    assignments = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(data[start:start + ASSIGN_CHUNK_SIZE], dtype=np.float32)
+        similarities = chunk @ centroids.T
+        if bias is not None:
+            similarities += bias
+        assignments[start:start + len(chunk)] = np.argmax(similarities, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """Inverted-file ANN index: k-means coarse quantizer plus per-centroid lists of row ids"""
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        # CSR layout: rows of list i are list_ids[list_offsets[i]:list_offsets[i + 1]]
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.list_ids = np.asarray(list_ids, dtype=np.int64)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.list_ids)
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_iter: int = 20,
+        centroids: Optional[np.ndarray] = None,
+    ) -> "IVFIndex":
+        """
+        Train the coarse quantizer and fill the inverted lists.
+        Passing existing centroids skips training and only reassigns rows (used after incremental reindexing).
+        """
+        if n_lists is None:
+            # Common rule of thumb: about sqrt(N) lists
+            n_lists = max(1, int(np.sqrt(len(embeddings))))
+
+        if centroids is None or centroids.shape[1] != embeddings.shape[1]:
+            centroids = kmeans(embeddings, n_lists, n_iter=n_iter)
+
+        assignments = assign_to_centroids(embeddings, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=len(centroids))
+        list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(centroids, list_offsets, order)
+
+    def update(self, kept_rows: np.ndarray, new_embeddings: np.ndarray) -> "IVFIndex":
+        """
+        Lists after an incremental reindex: rows not in kept_rows (sorted old rows) are dropped, the kept rows
+        are renumbered 0..k-1 and the new rows (k, k+1, ...) are assigned to the existing centroids.
+        Only the new rows are scored.
+        """
+        kept_rows = np.asarray(kept_rows, dtype=np.int64)
+        remap = np.full(self.n_rows, -1, dtype=np.int64)
+        remap[kept_rows] = np.arange(len(kept_rows))
+        old_ids = remap[self.list_ids]
+        keep = old_ids >= 0
+        old_lists = np.repeat(np.arange(self.n_lists), np.diff(self.list_offsets))[keep]
+        new_lists = assign_to_centroids(new_embeddings, self.centroids)
+
+        lists = np.concatenate([old_lists, new_lists])
+        ids = np.concatenate([old_ids[keep], np.arange(len(kept_rows), len(kept_rows) + len(new_embeddings))])
+        # Stable sort by list: ids within a list stay ascending, like after build()
+        order = np.argsort(lists, kind='stable')
+        counts = np.bincount(lists, minlength=self.n_lists)
+        return IVFIndex(self.centroids, np.concatenate([[0], np.cumsum(counts)]), ids[order])
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, list_offsets=self.list_offsets, list_ids=self.list_ids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IVFIndex"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data["centroids"], data["list_offsets"], data["list_ids"])
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Row ids in the nprobe lists whose centroids are closest to the query"""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        centroid_scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.n_lists)
+
+        starts = self.list_offsets[probe]
+        ends = self.list_offsets[probe + 1]
+        return np.concatenate([self.list_ids[s:e] for s, e in zip(starts, ends)])
+
+    def search(
+        self,
+        embeddings: np.ndarray,
+        query: np.ndarray,
+        nprobe: int,
+        valid_mask: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Score only the rows in the probed lists; returns (row ids, similarities)"""
+        ids = self.candidates(query, nprobe)
+        if valid_mask is not None:
+            ids = ids[valid_mask[ids]]
+        scores = np.asarray(embeddings[ids], dtype=np.float32) @ query
+        return ids, scores
@@ -0,0 +1,319 @@
+"""
+Offline benchmarks for the indexing and search hot paths.
+
+Runs without CLIP weights: a lightweight stand-in encoder replaces the model and search
+benchmarks use synthetic embeddings, so the numbers measure this project's own code
+(scanning, decode pipeline, index I/O, scoring and ranking), not the network.
+
+    python benchmark.py --output results.json
+    python benchmark.py --search-sizes 10000,100000,1000000,10000000 --output results.json
+    python benchmark.py --baseline baseline.json --tolerance 0.15   # exit code 1 on regressions
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from ann_index import IVFIndex
+from embedding_index import EmbeddingIndex
+from keyword_index import KeywordIndex, keyword_documents
+
+EMBEDDING_DIM = 512
+STAND_IN_RESOLUTION = 224
+
+QUERY_WORDS = [
+    "dog", "beach", "sunset", "mountain", "city", "food", "cat", "car",
+    "birthday", "snow", "forest", "river", "portrait", "night", "flowers", "bridge",
+]
+
+
+def stand_in_preprocess(image):
+    """Resize and scale to a CHW float tensor, like CLIP's preprocess but without normalization constants"""
+    import torch
+
+    image = image.resize((STAND_IN_RESOLUTION, STAND_IN_RESOLUTION))
+    array = np.asarray(image, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    return torch.from_numpy(np.ascontiguousarray(array))
+
+
+class StandInEncoder:
+    """Deterministic cheap encoder with the CLIP encoder interface: random projections of pooled pixels / tokens"""
+
+    name = "stand-in"
+
+    def __init__(self, dim: int = EMBEDDING_DIM, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.image_projection = rng.standard_normal((3 * 8 * 8, dim)).astype(np.float32)
+        self.token_table = rng.standard_normal((49408, dim)).astype(np.float32)
+
+    def encode_images(self, images) -> np.ndarray:
+        images = images.float().numpy()
+        n, c, h, w = images.shape
+        pooled = images.reshape(n, c, 8, h // 8, 8, w // 8).mean(axis=(3, 5)).reshape(n, -1)
+        return _normalize(pooled @ self.image_projection)
+
+    def encode_texts(self, tokens) -> np.ndarray:
+        tokens = tokens.numpy()
+        return _normalize(np.stack([self.token_table[row[row > 0]].sum(axis=0) for row in tokens]))
+
+
+def _normalize(features: np.ndarray) -> np.ndarray:
+    return features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    samples = np.asarray(samples_ms)
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+        "qps": float(1000.0 / samples.mean()) if samples.mean() > 0 else 0.0,
+    }
+
+
+def make_scan_tree(root: str, n_files: int, files_per_dir: int = 500):
+    """Empty files with a mix of image and non-image extensions, nested two levels deep"""
+    extensions = [".jpg", ".JPG", ".jpeg", ".png", ".heic", ".txt"]
+    for i in range(n_files):
+        directory = os.path.join(root, f"album{i // (files_per_dir * 20)}", f"day{(i // files_per_dir) % 20}")
+        if i % files_per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, f"IMG_{i:08d}{extensions[i % len(extensions)]}"), "wb").close()
+
+
+def make_image_library(root: str, n_images: int, size: int = 320):
+    """Small synthetic JPEGs, so decode cost is realistic but the library builds quickly"""
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (size, size, 3), dtype=np.uint8)
+    for i in range(n_images):
+        directory = os.path.join(root, f"album{i // 200}")
+        if i % 200 == 0:
+            os.makedirs(directory, exist_ok=True)
+        pixels = np.roll(base, i * 7, axis=(0, 1))
+        Image.fromarray(pixels).save(os.path.join(directory, f"IMG_{i:06d}.jpg"), quality=85)
+
+
+def bench_scan(main, work_dir: str, sizes: List[int], repeats: int) -> dict:
+    results = {}
+    for n_files in sizes:
+        root = os.path.join(work_dir, f"scan_{n_files}")
+        make_scan_tree(root, n_files)
+        timings = []
+        found = 0
+        for _ in range(repeats):
+            start = time.perf_counter()
+            found = len(main.get_image_files(root))
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results[str(n_files)] = {"files": n_files, "images_found": found, "seconds": best, "files_per_s": n_files / best}
+        print(f"scan      {n_files:>10,} files: {best:.3f}s ({n_files / best:,.0f} files/s)")
+        shutil.rmtree(root)
+    return results
+
+
+def bench_indexing(main, work_dir: str, n_images: int) -> dict:
+    library = os.path.join(work_dir, "library")
+    make_image_library(library, n_images)
+    main.PHOTO_LIBRARY_PATH = library
+
+    start = time.perf_counter()
+    main.index_images(force_reindex=True)
+    full_seconds = time.perf_counter() - start
+
+    # Second pass with nothing changed: only the scan and manifest check
+    start = time.perf_counter()
+    main.index_images()
+    noop_seconds = time.perf_counter() - start
+
+    print(f"index     {n_images:>10,} images: {full_seconds:.2f}s ({n_images / full_seconds:,.0f} images/s), "
+          f"unchanged re-run {noop_seconds:.2f}s")
+    return {
+        "images": n_images,
+        "seconds": full_seconds,
+        "images_per_s": n_images / full_seconds,
+        "unchanged_rerun_seconds": noop_seconds,
+    }
+
+
+def synthetic_embeddings(n_rows: int, dtype, chunk: int = 1_000_000) -> np.ndarray:
+    """Clustered unit vectors (so ANN behaves like on real photos), generated in chunks to bound memory"""
+    rng = np.random.default_rng(42)
+    centers = _normalize(rng.standard_normal((1024, EMBEDDING_DIM)).astype(np.float32))
+    embeddings = np.empty((n_rows, EMBEDDING_DIM), dtype=dtype)
+    for start in range(0, n_rows, chunk):
+        count = min(chunk, n_rows - start)
+        noise = rng.standard_normal((count, EMBEDDING_DIM)).astype(np.float32) * (0.5 / np.sqrt(EMBEDDING_DIM))
+        rows = centers[rng.integers(0, len(centers), count)] + noise
+        embeddings[start:start + count] = _normalize(rows)
+    return embeddings
+
+
+class SyntheticIndex(EmbeddingIndex):
+    """EmbeddingIndex over synthetic rows: every row counts as valid (the paths do not exist on disk)"""
+
+    def refresh_validity(self):
+        self.valid_mask = np.ones(len(self.paths), dtype=bool)
+
+
+def bench_search(main, sizes: List[int], n_queries: int, limit: int) -> dict:
+    results = {}
+    for n_rows in sizes:
+        embeddings = synthetic_embeddings(n_rows, np.dtype(main.EMBEDDINGS_DTYPE))
+        paths = [f"/synthetic/album{i // 1000}/IMG_{i:08d}.jpg" for i in range(n_rows)]
+        index = SyntheticIndex(embeddings, paths)
+        index.keywords = KeywordIndex.build(keyword_documents(paths, [None] * n_rows, "/synthetic"))
+
+        # mode -> SearchRequest fields; hybrid must stay as fast as exact (postings lookups plus a scatter-add)
+        modes = {"exact": {"exact": True}, "hybrid": {"exact": True, "mode": "hybrid"}}
+        if n_rows >= main.ANN_MIN_IMAGES:
+            start = time.perf_counter()
+            index.ann = IVFIndex.build(embeddings, n_lists=main.ANN_NLISTS or None)
+            print(f"ann build {n_rows:>10,} rows: {time.perf_counter() - start:.1f}s")
+            modes["ann"] = {"exact": False}
+        main.embedding_index = index
+
+        size_results = {}
+        for mode, fields in modes.items():
+            timings = []
+            for i in range(n_queries):
+                # Distinct queries, so every request pays for text encoding like a cache miss; the album
+                # name gives hybrid queries a keyword match of about 1000 rows
+                query = f"{QUERY_WORDS[i % len(QUERY_WORDS)]} {QUERY_WORDS[(i // len(QUERY_WORDS)) % len(QUERY_WORDS)]} {mode} {i} album{i % max(1, n_rows // 1000)}"
+                request = main.SearchRequest(query=query, limit=limit, **fields)
+                start = time.perf_counter()
+                main.run_search_batch([request])
+                timings.append((time.perf_counter() - start) * 1000.0)
+            size_results[mode] = percentiles(timings)
+            print(f"search    {n_rows:>10,} rows ({mode:5}): p50 {size_results[mode]['p50_ms']:.2f}ms "
+                  f"p99 {size_results[mode]['p99_ms']:.2f}ms")
+        results[str(n_rows)] = size_results
+
+        main.embedding_index = None
+        del index, embeddings
+    return results
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """{"search": {"10000": {"exact": {"p50_ms": 1.2}}}} -> {"search.10000.exact.p50_ms": 1.2}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = float(value)
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (a fraction)"""
+    current, previous = flatten(results["results"]), flatten(baseline["results"])
+    regressions = []
+    for name, value in sorted(current.items()):
+        old = previous.get(name)
+        if old is None or old == 0:
+            continue
+        if name.endswith("_per_s") or name.endswith(".qps"):
+            change = (old - value) / old  # throughput: lower is worse
+        elif name.endswith("_ms") or name.endswith("seconds"):
+            change = (value - old) / old  # latency: higher is worse
+        else:
+            continue
+        status = "REGRESSION" if change > tolerance else "ok"
+        print(f"{status:>10}  {name}: {old:.4g} -> {value:.4g} ({change:+.1%} worse)")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(float(size)) for size in value.split(",") if size.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for scanning, indexing and search")
+    parser.add_argument("--scan-sizes", type=parse_sizes, default=parse_sizes("10000,100000"),
+                        help="Library sizes (files) for the get_image_files scan benchmark")
+    parser.add_argument("--index-images", type=int, default=2000,
+                        help="Synthetic JPEGs encoded by the index_images benchmark (0 to skip)")
+    parser.add_argument("--search-sizes", type=parse_sizes, default=parse_sizes("10000,100000,1000000"),
+                        help="Index sizes for the search benchmark (10M float16 rows need about 10 GB of RAM)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per search benchmark")
+    parser.add_argument("--limit", type=int, default=20, help="Results per query")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats per scan benchmark (best is reported)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --output file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown vs. the baseline (fraction)")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    # The backend keeps its index files in the working directory: run everything in a scratch directory
+    work_dir = tempfile.mkdtemp(prefix="photo-search-bench-")
+    os.environ.setdefault("THUMBNAIL_CACHE_DIR", os.path.join(work_dir, "thumbnail_cache"))
+    os.environ["WATCH_LIBRARY"] = "0"
+    os.environ["QUERY_BATCHING"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        import main as backend
+
+        backend.clip_preprocess = stand_in_preprocess
+        backend.image_preprocess = stand_in_preprocess
+        backend.clip_encoder = StandInEncoder()
+        backend.model_status = "ready"
+
+        results = {}
+        if args.scan_sizes:
+            results["scan"] = bench_scan(backend, work_dir, args.scan_sizes, args.repeats)
+        if args.index_images > 0:
+            results["index"] = bench_indexing(backend, work_dir, args.index_images)
+        if args.search_sizes:
+            results["search"] = bench_search(backend, args.search_sizes, args.queries, args.limit)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "encoder": StandInEncoder.name,
+            "embeddings_dtype": backend.EMBEDDINGS_DTYPE,
+            "index_num_workers": backend.INDEX_NUM_WORKERS,
+        },
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
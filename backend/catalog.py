@@ -0,0 +1,244 @@
+import os
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+
+from keyword_index import read_caption
+
+# EXIF tags: Make, Model and DateTime in IFD0, DateTimeOriginal in the Exif sub-IFD
+EXIF_MAKE = 0x010F
+EXIF_MODEL = 0x0110
+EXIF_DATETIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+
+# Bumped when the schema changes; catalogs with another version are rebuilt from scratch
+CATALOG_VERSION = 2
+
+SCHEMA = f"""
+CREATE TABLE images (
+    id INTEGER PRIMARY KEY,          -- row of the image in the embedding matrix
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    taken_at TEXT,                   -- EXIF capture time as ISO 8601 (YYYY-MM-DDTHH:MM:SS), sorts as text
+    camera TEXT COLLATE NOCASE,
+    caption TEXT                     -- text of a .txt/.xmp sidecar, for keyword search
+);
+CREATE INDEX images_taken_at ON images (taken_at);
+CREATE INDEX images_camera ON images (camera);
+PRAGMA user_version = {CATALOG_VERSION};
+"""
+
+
+class ImageRecord(NamedTuple):
+    path: str
+    size: Optional[int]
+    mtime_ns: Optional[int]
+    width: Optional[int]
+    height: Optional[int]
+    taken_at: Optional[str]
+    camera: Optional[str]
+    caption: Optional[str]
+
+
+def _exif_datetime(value) -> Optional[str]:
+    """'YYYY:MM:DD HH:MM:SS' -> 'YYYY-MM-DDTHH:MM:SS'; None for missing or zeroed-out values"""
+    if not isinstance(value, str) or len(value) < 10 or value.startswith("0000"):
+        return None
+    value = value.strip("\x00 ")
+    day, _, time_of_day = value.partition(" ")
+    day = day.replace(":", "-")
+    return f"{day}T{time_of_day}" if time_of_day else day
+
+
+def read_image_record(path: str, signature: Optional[dict] = None) -> ImageRecord:
+    """
+    Dimensions and EXIF capture date/camera from the image header (pixel data is not decoded),
+    plus the caption of a sidecar file if there is one
+    """
+    width = height = taken_at = camera = caption = None
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            exif = image.getexif()
+            taken_at = _exif_datetime(exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL)) or _exif_datetime(exif.get(EXIF_DATETIME))
+            make = str(exif.get(EXIF_MAKE) or "").strip("\x00 ")
+            model = str(exif.get(EXIF_MODEL) or "").strip("\x00 ")
+            # Most models already start with the make ("Canon EOS R5"), some don't ("NIKON CORPORATION" + "D750")
+            camera = model if model.lower().startswith(make.lower()) else f"{make} {model}".strip()
+            camera = camera or None
+    except Exception as e:
+        print(f"⚠️  Cannot read metadata of {path}: {e}")
+    try:
+        caption = read_caption(path)
+    except OSError as e:
+        print(f"⚠️  Cannot read sidecar of {path}: {e}")
+    signature = signature or {}
+    return ImageRecord(path, signature.get("size"), signature.get("mtime_ns"), width, height, taken_at, camera, caption)
+
+
+def read_image_records(
+    paths: List[str],
+    signatures: List[Optional[dict]],
+    num_workers: int = 8,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> List[ImageRecord]:
+    """
+    Header metadata of many images, read by a thread pool (header reads are I/O bound, like the library
+    scan). on_progress(1) is called per image; if it raises (e.g. a cancelled reindex), queued reads are dropped.
+    """
+    records = []
+    executor = ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix="catalog")
+    try:
+        for record in executor.map(read_image_record, paths, signatures):
+            records.append(record)
+            if on_progress is not None:
+                on_progress(1)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return records
+
+
+INSERT_SQL = "INSERT INTO images (id, path, size, mtime_ns, width, height, taken_at, camera, caption) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def _write_atomically(catalog_file: str, apply: Callable[[sqlite3.Connection], None], base: Optional[str] = None):
+    """
+    Build the catalog in a temp file (a copy of `base`, or a new database) and rename it into place,
+    so open catalogs keep seeing the old one until the new index is swapped in
+    """
+    tmp_path = f"{catalog_file}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    if base is not None:
+        shutil.copyfile(base, tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        if base is None:
+            connection.executescript(SCHEMA)
+        apply(connection)
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, catalog_file)
+
+
+def write_catalog(catalog_file: str, records: List[ImageRecord]):
+    """Write a new catalog whose rows are `records`, in embedding row order"""
+    _write_atomically(catalog_file, lambda connection: connection.executemany(
+        INSERT_SQL, ((row, *record) for row, record in enumerate(records))
+    ))
+
+
+def update_catalog(catalog_file: str, kept_rows: np.ndarray, old_row_count: int, new_records: List[ImageRecord]):
+    """
+    Apply an incremental reindex to the catalog: rows not in kept_rows (sorted old row ids) are deleted,
+    the kept rows are renumbered 0..k-1 in order, and new_records are appended as rows k, k+1, ...
+    Only deleted, shifted and new rows are touched.
+    """
+    kept_rows = np.asarray(kept_rows, dtype=np.int64)
+    removed = np.setdiff1d(np.arange(old_row_count, dtype=np.int64), kept_rows, assume_unique=True)
+    moved = np.flatnonzero(kept_rows != np.arange(len(kept_rows)))
+
+    def apply(connection: sqlite3.Connection):
+        connection.executemany("DELETE FROM images WHERE id = ?", ((int(row),) for row in removed))
+        # Two passes through negative ids, so no intermediate id collides with a row not yet moved
+        connection.executemany(
+            "UPDATE images SET id = ? WHERE id = ?",
+            ((-1 - int(new_row), int(kept_rows[new_row])) for new_row in moved),
+        )
+        connection.execute("UPDATE images SET id = -1 - id WHERE id < 0")
+        connection.executemany(
+            INSERT_SQL, ((len(kept_rows) + i, *record) for i, record in enumerate(new_records))
+        )
+
+    _write_atomically(catalog_file, apply, base=catalog_file)
+
+
+class ImageCatalog:
+    """
+    Read side of the SQLite image catalog that accompanies a loaded index. The connection is opened
+    when the index is loaded, so a catalog rewritten by a reindex is only seen once the new index is swapped in.
+    """
+
+    def __init__(self, catalog_file: str):
+        self.catalog_file = catalog_file
+        # Shared by the request threads; sqlite3 connections are not safe for concurrent use, hence the lock
+        self._connection = sqlite3.connect(f"file:{catalog_file}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, catalog_file: str) -> Optional["ImageCatalog"]:
+        """Open the catalog, or return None if it has not been built yet or has an older schema"""
+        if not os.path.exists(catalog_file):
+            return None
+        catalog = cls(catalog_file)
+        if catalog._query("PRAGMA user_version")[0][0] != CATALOG_VERSION:
+            catalog.close()
+            return None
+        return catalog
+
+    def close(self):
+        self._connection.close()
+
+    def _query(self, sql: str, params: Iterable = ()) -> list:
+        with self._lock:
+            return self._connection.execute(sql, tuple(params)).fetchall()
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM images")[0][0]
+
+    def captions(self) -> Iterator[Optional[str]]:
+        """Caption of every row, in row order"""
+        for (caption,) in self._query("SELECT caption FROM images ORDER BY id"):
+            yield caption
+
+    def filter_rows(
+        self,
+        taken_after: Optional[date] = None,
+        taken_before: Optional[date] = None,
+        folder: Optional[str] = None,
+        camera: Optional[str] = None,
+    ) -> np.ndarray:
+        """
+        Sorted embedding rows matching every given filter: capture date range (inclusive, images without
+        an EXIF date never match a date filter), folder prefix (absolute path) and camera (case-insensitive)
+        """
+        clauses, params = [], []
+        if taken_after is not None:
+            clauses.append("taken_at >= ?")
+            params.append(taken_after.isoformat())
+        if taken_before is not None:
+            # Inclusive end date: everything before the start of the next day
+            clauses.append("taken_at < ?")
+            params.append((taken_before + timedelta(days=1)).isoformat())
+        if folder is not None:
+            # Prefix match as a range on the unique path index (LIKE would need escaping and skip the index)
+            prefix = folder.rstrip(os.sep) + os.sep
+            clauses.append("path >= ? AND path < ?")
+            params.extend([prefix, prefix[:-1] + chr(ord(os.sep) + 1)])
+        if camera is not None:
+            clauses.append("camera = ?")
+            params.append(camera)
+
+        sql = "SELECT id FROM images"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        rows = self._query(sql + " ORDER BY id", params)
+        return np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+
+    def cameras(self) -> List[dict]:
+        """Distinct cameras with their image counts, most common first"""
+        rows = self._query(
+            "SELECT camera, COUNT(*) FROM images WHERE camera IS NOT NULL GROUP BY camera ORDER BY COUNT(*) DESC"
+        )
+        return [{"camera": camera, "images": count} for camera, count in rows]
@@ -0,0 +1,325 @@
+import os
+import json
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ann_index import IVFIndex
+from metrics import timed
+from quantization import load_quantizer
+
+# Rows upcast to float32 at a time when scoring float16 embeddings
+SCORE_CHUNK_ROWS = 65536
+
+# Queries scored per matrix-matrix product in search_batch, to bound the (queries x images) score matrix
+BATCH_SCORE_QUERIES = 64
+
+
+def rank_top_k(
+    scores: np.ndarray,
+    limit: int,
+    threshold: Optional[float] = None,
+    ids: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Best-first top-`limit` of a score vector in O(N + k log k): argpartition, then sort only the winners.
+    Rows scoring -inf (missing files) are dropped. With a threshold, winners below it are masked out,
+    but the single best row is still returned if none pass. `ids` maps score positions to row ids.
+    """
+    k = min(limit, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    if k < len(scores):
+        top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(scores[top])[::-1]]
+    top_scores = scores[top]
+
+    keep = top_scores > -np.inf
+    if threshold is not None:
+        passing = keep & (top_scores >= threshold)
+        # If no results meet threshold, return top result anyway
+        keep = passing if passing.any() else keep & (np.arange(len(top)) == 0)
+    top, top_scores = top[keep], top_scores[keep]
+
+    if ids is not None:
+        top = ids[top]
+    return top, top_scores
+
+
+def add_boost(scores: np.ndarray, boost: Tuple[np.ndarray, np.ndarray], ids: Optional[np.ndarray] = None):
+    """
+    Add per-row bonuses (sorted rows, values), e.g. weighted keyword matches, to a score vector in place.
+    `ids` (sorted) maps score positions to rows; without it positions are rows. Missing files stay at -inf.
+    """
+    rows, values = boost
+    if ids is None:
+        scores[rows] += values
+        return
+    if len(ids) == 0:
+        return
+    positions = np.minimum(np.searchsorted(ids, rows), len(ids) - 1)
+    hit = ids[positions] == rows
+    scores[positions[hit]] += values[hit]
+
+
+class EmbeddingIndex:
+    """
+    Image index held by the server: contiguous float32/float16 embedding matrix (in memory or
+    memory-mapped from the .npy file), path table and validity mask
+    """
+
+    def __init__(self, embeddings: np.ndarray, paths: List[str], valid_mask: Optional[np.ndarray] = None):
+        if len(embeddings) != len(paths):
+            raise ValueError(
+                f"Index mismatch: {len(embeddings)} embeddings but {len(paths)} paths"
+            )
+        if embeddings.dtype not in (np.float16, np.float32):
+            embeddings = embeddings.astype(np.float32)
+        # Memory-mapped arrays are used as-is so the data stays shared with the OS page cache
+        self.embeddings = embeddings if isinstance(embeddings, np.memmap) else np.ascontiguousarray(embeddings)
+        self.paths = list(paths)
+        self.valid_mask = np.ones(len(self.paths), dtype=bool)
+        # Optional approximate nearest-neighbour index over the same rows
+        self.ann: Optional[IVFIndex] = None
+        # Optional compressed codes (ScalarQuantizer / ProductQuantizer) scored before exact re-ranking
+        self.quantizer = None
+        self.rerank_candidates = 256
+        # Optional SQLite catalog (ImageCatalog) with per-row metadata, used to pre-filter searches
+        self.catalog = None
+        # Optional inverted index (KeywordIndex) over paths and captions, for hybrid search
+        self.keywords = None
+        # path -> row lookup, built on first use
+        self._rows: Optional[dict] = None
+        if valid_mask is not None and len(valid_mask) == len(self.paths):
+            self.valid_mask = np.asarray(valid_mask, dtype=bool)
+        else:
+            self.refresh_validity()
+
+    @classmethod
+    def load(
+        cls,
+        embeddings_file: str,
+        paths_file: str,
+        ann_file: Optional[str] = None,
+        mmap: bool = True,
+        codes_file: Optional[str] = None,
+        valid_mask: Optional[np.ndarray] = None,
+    ) -> Optional["EmbeddingIndex"]:
+        """
+        Load the index from disk (memory-mapped by default), or return None if it has not been built yet.
+        Without a valid_mask, every indexed file is checked on disk.
+        """
+        if not os.path.exists(embeddings_file) or not os.path.exists(paths_file):
+            return None
+
+        embeddings = np.load(embeddings_file, mmap_mode='r' if mmap else None)
+        with open(paths_file, 'r') as f:
+            paths = json.load(f)
+
+        index = cls(embeddings, paths, valid_mask=valid_mask)
+        if ann_file is not None:
+            ann = IVFIndex.load(ann_file)
+            if ann is not None and ann.n_rows == len(index) and ann.centroids.shape[1] == index.dim:
+                index.ann = ann
+            elif ann is not None:
+                print("⚠️  ANN index does not match embeddings, using exact search until it is rebuilt")
+        if codes_file is not None:
+            quantizer = load_quantizer(codes_file)
+            if quantizer is not None and quantizer.n_rows == len(index):
+                index.quantizer = quantizer
+            elif quantizer is not None:
+                print("⚠️  Compressed codes do not match embeddings, scoring full vectors until they are rebuilt")
+        return index
+
+    def refresh_validity(self):
+        """Recompute which indexed files still exist on disk"""
+        with timed("validity_check"):
+            self.valid_mask = np.fromiter(
+                (os.path.exists(p) for p in self.paths), dtype=bool, count=len(self.paths)
+            )
+        missing = len(self.paths) - self.num_valid
+        if missing:
+            print(f"⚠️  Warning: {missing} indexed images no longer exist. Consider reindexing.")
+
+    @property
+    def num_valid(self) -> int:
+        return int(self.valid_mask.sum())
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1] if self.embeddings.ndim == 2 else 0
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def row_for_path(self, path: str) -> Optional[int]:
+        if self._rows is None:
+            self._rows = {p: row for row, p in enumerate(self.paths)}
+        return self._rows.get(path)
+
+    def vector(self, row: int) -> np.ndarray:
+        """Stored (normalized) embedding of one row as float32"""
+        return np.asarray(self.embeddings[row], dtype=np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.embeddings.nbytes)
+
+    def matmul(self, queries: np.ndarray) -> np.ndarray:
+        """(queries x images) similarity matrix in float32; float16 storage is upcast one chunk at a time"""
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.embeddings.dtype == np.float32:
+            return queries @ self.embeddings.T
+
+        # NumPy has no BLAS path for float16, so convert bounded chunks instead of the whole matrix
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_CHUNK_ROWS):
+            chunk = np.asarray(self.embeddings[start:start + SCORE_CHUNK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(chunk)] = queries @ chunk.T
+        return scores
+
+    def score(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row against a normalized query; missing files score -inf"""
+        similarities = self.matmul(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+        if not self.valid_mask.all():
+            similarities[~self.valid_mask] = -np.inf
+        return similarities
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        limit: int,
+        threshold: Optional[float] = None,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        rows: Optional[np.ndarray] = None,
+        boost: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-`limit` rows for a normalized query, best first; returns (row ids, similarities).
+        Uses the ANN index when available unless exact search is requested; nprobe trades recall for latency.
+        With `rows` (sorted, e.g. the catalog rows matching a filter) only that subset is scored, exactly.
+        `boost` (sorted rows, values) is added to the similarities of those rows before ranking.
+        """
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        if rows is not None:
+            return self.search_rows(query_embedding, rows, limit, threshold, boost)
+        if boost is not None and (self.uses_ann(nprobe, exact) or self.uses_codes(exact)):
+            # Boosted rows can be missing from the approximate candidates: score the vector top-k
+            # together with the boosted rows exactly, so the fused ranking covers both
+            candidates, _ = self.search(query_embedding, limit, nprobe=nprobe, exact=exact)
+            return self.search_rows(query_embedding, np.union1d(candidates, boost[0]), limit, threshold, boost)
+        if self.uses_codes(exact) and not self.uses_ann(nprobe, exact):
+            return self.search_compressed(query_embedding, limit, threshold)
+
+        with timed("scoring"):
+            if self.uses_ann(nprobe, exact):
+                ids, scores = self.ann.search(self.embeddings, query_embedding, nprobe, self.valid_mask)
+            else:
+                # Exact search over every row; missing files score -inf and are dropped by the ranking
+                ids, scores = None, self.score(query_embedding)
+                if boost is not None:
+                    add_boost(scores, boost)
+
+        with timed("ranking"):
+            return rank_top_k(scores, limit, threshold=threshold, ids=ids)
+
+    def uses_ann(self, nprobe: Optional[int], exact: bool) -> bool:
+        return self.ann is not None and not exact and nprobe is not None and nprobe < self.ann.n_lists
+
+    def uses_codes(self, exact: bool) -> bool:
+        return self.quantizer is not None and not exact
+
+    def search_compressed(self, query_embedding: np.ndarray, limit: int, threshold: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Score the compressed codes, then re-rank the best candidates with the full-precision vectors"""
+        with timed("scoring"):
+            approx_scores = self.quantizer.score(query_embedding)
+            if not self.valid_mask.all():
+                approx_scores[~self.valid_mask] = -np.inf
+        with timed("ranking"):
+            candidates, _ = rank_top_k(approx_scores, max(limit, self.rerank_candidates))
+        with timed("rerank"):
+            # Sorted ids read the (possibly memory-mapped) vectors in file order
+            candidates = np.sort(candidates)
+            exact_scores = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query_embedding
+        with timed("ranking"):
+            return rank_top_k(exact_scores, limit, threshold=threshold, ids=candidates)
+
+    def search_rows(
+        self,
+        query_embedding: np.ndarray,
+        rows: np.ndarray,
+        limit: int,
+        threshold: Optional[float] = None,
+        boost: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact search over a sorted subset of rows; sorted row ids read memory-mapped vectors in file order.
+        Rows are gathered and upcast SCORE_CHUNK_ROWS at a time, so a broad filter never copies its whole
+        subset; a subset covering most of the index is scored like an unfiltered search and then picked out.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        with timed("scoring"):
+            if 2 * len(rows) >= len(self):
+                scores = self.matmul(query_embedding[None, :])[0][rows]
+            else:
+                scores = np.empty(len(rows), dtype=np.float32)
+                for start in range(0, len(rows), SCORE_CHUNK_ROWS):
+                    chunk = np.asarray(self.embeddings[rows[start:start + SCORE_CHUNK_ROWS]], dtype=np.float32)
+                    scores[start:start + len(chunk)] = chunk @ query_embedding
+            valid = self.valid_mask[rows]
+            if not valid.all():
+                scores[~valid] = -np.inf
+            if boost is not None:
+                add_boost(scores, boost, ids=rows)
+        with timed("ranking"):
+            return rank_top_k(scores, limit, threshold=threshold, ids=rows)
+
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        limits: List[int],
+        thresholds: List[Optional[float]],
+        nprobes: List[Optional[int]],
+        exacts: List[bool],
+        row_subsets: Optional[List[Optional[np.ndarray]]] = None,
+        boosts: Optional[List[Optional[Tuple[np.ndarray, np.ndarray]]]] = None,
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Search many queries at once. Exact queries are scored together with one matrix-matrix product
+        per block of queries (boosts are added to their rows of the score matrix); queries that go through
+        the ANN index or compressed codes, or that are restricted to a subset of rows, are searched one by one.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        results: List[Optional[Tuple[np.ndarray, np.ndarray]]] = [None] * len(query_embeddings)
+        row_subsets = row_subsets or [None] * len(query_embeddings)
+        boosts = boosts or [None] * len(query_embeddings)
+
+        exact_queries = []
+        for i in range(len(query_embeddings)):
+            if row_subsets[i] is not None or self.uses_ann(nprobes[i], exacts[i]) or self.uses_codes(exacts[i]):
+                results[i] = self.search(
+                    query_embeddings[i], limits[i], thresholds[i], nprobes[i], exacts[i], rows=row_subsets[i], boost=boosts[i]
+                )
+            else:
+                exact_queries.append(i)
+
+        for start in range(0, len(exact_queries), BATCH_SCORE_QUERIES):
+            block = exact_queries[start:start + BATCH_SCORE_QUERIES]
+            # (queries x images), row-major so each query's scores are contiguous for ranking
+            with timed("scoring"):
+                scores = self.matmul(query_embeddings[block])
+                if not self.valid_mask.all():
+                    scores[:, ~self.valid_mask] = -np.inf
+                for row, i in enumerate(block):
+                    if boosts[i] is not None:
+                        add_boost(scores[row], boosts[i])
+            with timed("ranking"):
+                for row, i in enumerate(block):
+                    results[i] = rank_top_k(scores[row], limits[i], threshold=thresholds[i])
+
+        return results
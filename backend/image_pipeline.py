@@ -0,0 +1,137 @@
+import collections
+import itertools
+import multiprocessing
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Preprocessing transform used inside worker processes (set by _init_worker)
+_worker_preprocess = None
+
+
+def _init_worker(preprocess, limit_threads: bool = True):
+    """Set up a decode worker: keep the transform around and stay single-threaded"""
+    global _worker_preprocess
+    _worker_preprocess = preprocess
+    if limit_threads:
+        # Each worker handles one image at a time, so intra-op threads only oversubscribe the CPU
+        torch.set_num_threads(1)
+
+
+def _load_image(image_path: str) -> Tuple[str, Optional[np.ndarray]]:
+    """Decode and preprocess a single image, returning None on failure"""
+    try:
+        load = getattr(_worker_preprocess, "load", None)
+        if load is not None:
+            # Preprocessors with their own decode step (FastClipPreprocess decodes JPEGs at reduced size)
+            return image_path, load(image_path).numpy()
+        image = Image.open(image_path).convert('RGB')
+        return image_path, _worker_preprocess(image).numpy()
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return image_path, None
+
+
+def _load_images(image_paths: List[str]) -> List[Tuple[str, Optional[np.ndarray]]]:
+    return [_load_image(image_path) for image_path in image_paths]
+
+
+def _bounded_imap(pool, image_paths: Iterator[str], chunksize: int, max_in_flight: int) -> Iterator[Tuple[str, Optional[np.ndarray]]]:
+    """
+    Like pool.imap(_load_image, ...), but with at most max_in_flight images submitted and not yet consumed.
+    pool.imap feeds the whole input to the workers and buffers every result, so when decoding outpaces
+    encoding the preprocessed arrays (~600 KB each) pile up in the parent without bound.
+    """
+    pending = collections.deque()
+    in_flight = 0
+    exhausted = False
+    while True:
+        while not exhausted and in_flight + chunksize <= max(max_in_flight, chunksize):
+            chunk = list(itertools.islice(image_paths, chunksize))
+            if not chunk:
+                exhausted = True
+                break
+            pending.append((len(chunk), pool.apply_async(_load_images, (chunk,))))
+            in_flight += len(chunk)
+        if not pending:
+            return
+        size, result = pending.popleft()
+        in_flight -= size
+        yield from result.get()
+
+
+def iter_preprocessed_batches(
+    image_paths: Iterable[str],
+    preprocess,
+    batch_size: int = 32,
+    num_workers: int = 0,
+    prefetch_batches: int = 4,
+) -> Iterator[Tuple[List[str], Optional[torch.Tensor], List[str]]]:
+    """
+    Decode and preprocess images in a pool of worker processes, grouped into fixed-size batches.
+    Yields (paths, stacked image tensor, failed paths); the tensor is None if every image failed.
+    At most prefetch_batches batches are decoded ahead of the consumer.
+    """
+    image_paths = iter(image_paths)
+    first_path = next(image_paths, None)
+    if first_path is None:
+        # Nothing to encode (e.g. an unchanged library): don't start any worker processes
+        return
+    image_paths = itertools.chain([first_path], image_paths)
+
+    pool = None
+    if num_workers > 0:
+        pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(preprocess,))
+        # Small chunks keep workers busy without holding back the first batch
+        loaded = _bounded_imap(
+            pool, image_paths, chunksize=max(1, batch_size // num_workers), max_in_flight=max(1, prefetch_batches) * batch_size
+        )
+    else:
+        _init_worker(preprocess, limit_threads=False)
+        loaded = map(_load_image, image_paths)
+
+    try:
+        batch_paths, batch_arrays, failed = [], [], []
+        for image_path, array in loaded:
+            if array is None:
+                failed.append(image_path)
+            else:
+                batch_paths.append(image_path)
+                batch_arrays.append(array)
+
+            if len(batch_paths) + len(failed) >= batch_size:
+                yield batch_paths, _stack(batch_arrays), failed
+                batch_paths, batch_arrays, failed = [], [], []
+
+        if batch_paths or failed:
+            yield batch_paths, _stack(batch_arrays), failed
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _stack(arrays: List[np.ndarray]) -> Optional[torch.Tensor]:
+    return torch.from_numpy(np.stack(arrays)) if arrays else None
+
+
+def encode_image_batches(
+    image_paths: Iterable[str],
+    preprocess,
+    encode_batch: Callable[[torch.Tensor], np.ndarray],
+    batch_size: int = 32,
+    num_workers: int = 0,
+) -> Iterator[Tuple[List[str], np.ndarray, List[str]]]:
+    """
+    Run the full indexing pipeline: parallel decode/preprocess feeding batched encoding.
+    Yields (paths, embeddings, failed paths) per batch, with embeddings row-aligned to paths.
+    """
+    for batch_paths, batch_tensor, failed in iter_preprocessed_batches(
+        image_paths, preprocess, batch_size=batch_size, num_workers=num_workers
+    ):
+        if batch_tensor is None:
+            yield batch_paths, np.empty((0, 0), dtype=np.float32), failed
+            continue
+        yield batch_paths, encode_batch(batch_tensor), failed
@@ -0,0 +1,247 @@
+import copy
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+
+try:
+    import onnxruntime as ort
+except ImportError:  # optional dependency: only needed for INFERENCE_BACKEND=onnx
+    ort = None
+
+INFERENCE_BACKENDS = ("torch", "torchscript", "onnx")
+
+# Prompts used by the accuracy check (image samples come from the library)
+ACCURACY_CHECK_TEXTS = [
+    "a photo of a dog",
+    "sunset over the ocean",
+    "people at a birthday party",
+    "a red car parked on the street",
+    "snowy mountains",
+    "a plate of food on a table",
+    "a cat sleeping on a sofa",
+    "city skyline at night",
+]
+
+
+def normalize_rows(features: np.ndarray) -> np.ndarray:
+    features = np.asarray(features, dtype=np.float32)
+    return features / np.maximum(np.linalg.norm(features, axis=-1, keepdims=True), 1e-12)
+
+
+class _ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.encode_image(images)
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+class TorchEncoder:
+    """Stock PyTorch CLIP model, optionally with int8 dynamic quantization of its Linear layers (CPU only)"""
+
+    def __init__(self, model, device: str, quantize: bool = False):
+        self.device = device
+        self.quantize = quantize and device == "cpu"
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    @property
+    def name(self) -> str:
+        return "torch-int8" if self.quantize else "torch"
+
+    def encode_images(self, images: torch.Tensor) -> np.ndarray:
+        with torch.no_grad():
+            features = self.model.encode_image(images.to(self.device))
+        return normalize_rows(features.float().cpu().numpy())
+
+    def encode_texts(self, tokens: torch.Tensor) -> np.ndarray:
+        with torch.no_grad():
+            features = self.model.encode_text(tokens.to(self.device))
+        return normalize_rows(features.float().cpu().numpy())
+
+
+class TorchScriptEncoder(TorchEncoder):
+    """Traced and frozen text and image towers (saved to disk, so later startups skip tracing)"""
+
+    def __init__(self, model, device: str, quantize: bool, cache_dir: str, model_key: str):
+        super().__init__(model, device, quantize)
+        image_file = os.path.join(cache_dir, f"{model_key}_{self.name}_image.pt")
+        text_file = os.path.join(cache_dir, f"{model_key}_{self.name}_text.pt")
+        if os.path.exists(image_file) and os.path.exists(text_file):
+            self.image_tower = torch.jit.load(image_file, map_location=device)
+            self.text_tower = torch.jit.load(text_file, map_location=device)
+        else:
+            # Trace with a batch of 2 so the batch dimension is not baked in as a constant
+            resolution = model.visual.input_resolution
+            example_images = torch.zeros(2, 3, resolution, resolution, dtype=model.dtype, device=device)
+            example_tokens = torch.ones(2, model.context_length, dtype=torch.long, device=device)
+            with torch.no_grad():
+                self.image_tower = _freeze(torch.jit.trace(_ImageTower(self.model).eval(), example_images))
+                self.text_tower = _freeze(torch.jit.trace(_TextTower(self.model).eval(), example_tokens))
+            os.makedirs(cache_dir, exist_ok=True)
+            torch.jit.save(self.image_tower, image_file)
+            torch.jit.save(self.text_tower, text_file)
+
+    @property
+    def name(self) -> str:
+        return "torchscript-int8" if self.quantize else "torchscript"
+
+    def encode_images(self, images: torch.Tensor) -> np.ndarray:
+        with torch.no_grad():
+            features = self.image_tower(images.to(self.device))
+        return normalize_rows(features.float().cpu().numpy())
+
+    def encode_texts(self, tokens: torch.Tensor) -> np.ndarray:
+        with torch.no_grad():
+            features = self.text_tower(tokens.to(self.device))
+        return normalize_rows(features.float().cpu().numpy())
+
+
+def _freeze(traced):
+    """Freeze and apply inference-only graph optimizations where this torch version supports them"""
+    try:
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    except Exception:
+        return traced
+
+
+class OnnxEncoder:
+    """Text and image towers exported to ONNX and run with ONNX Runtime (optionally int8 weight-quantized)"""
+
+    def __init__(self, model, device: str, quantize: bool, cache_dir: str, model_key: str, num_threads: int = 0):
+        if ort is None:
+            raise RuntimeError("onnxruntime is not installed")
+        self.quantize = quantize
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Export from the fp32 CPU model; ONNX Runtime does its own graph optimizations
+        model = copy.deepcopy(model).float().cpu().eval()
+        resolution = model.visual.input_resolution
+        image_file = self._export(
+            _ImageTower(model), torch.zeros(2, 3, resolution, resolution),
+            os.path.join(cache_dir, f"{model_key}_image.onnx"), "images"
+        )
+        text_file = self._export(
+            _TextTower(model), torch.ones(2, model.context_length, dtype=torch.long),
+            os.path.join(cache_dir, f"{model_key}_text.onnx"), "tokens"
+        )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(image_file, options, providers=providers)
+        self.text_session = ort.InferenceSession(text_file, options, providers=providers)
+
+    @property
+    def name(self) -> str:
+        return "onnx-int8" if self.quantize else "onnx"
+
+    def _export(self, tower: torch.nn.Module, example: torch.Tensor, path: str, input_name: str) -> str:
+        if not os.path.exists(path):
+            tmp_path = f"{path}.tmp"
+            with torch.no_grad():
+                torch.onnx.export(
+                    tower, example, tmp_path,
+                    input_names=[input_name], output_names=["features"],
+                    dynamic_axes={input_name: {0: "batch"}, "features": {0: "batch"}},
+                    opset_version=14,
+                )
+            os.replace(tmp_path, path)
+
+        if not self.quantize:
+            return path
+        quantized_path = path.replace(".onnx", "_int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+        return quantized_path
+
+    def encode_images(self, images: torch.Tensor) -> np.ndarray:
+        features = self.image_session.run(None, {"images": images.float().cpu().numpy()})[0]
+        return normalize_rows(features)
+
+    def encode_texts(self, tokens: torch.Tensor) -> np.ndarray:
+        features = self.text_session.run(None, {"tokens": tokens.cpu().numpy().astype(np.int64)})[0]
+        return normalize_rows(features)
+
+
+def create_encoder(
+    backend: str,
+    model,
+    device: str,
+    quantize: bool = False,
+    num_threads: int = 0,
+    cache_dir: str = "inference_cache",
+    model_name: str = "ViT-B/32",
+):
+    """
+    Encoder for the selected inference backend. Falls back to the stock PyTorch model
+    (with a warning) if the backend is unknown or cannot be set up here.
+    """
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+    model_key = model_name.replace("/", "-").replace("@", "-")
+    try:
+        if backend == "torch":
+            return TorchEncoder(model, device, quantize)
+        if backend == "torchscript":
+            return TorchScriptEncoder(model, device, quantize, cache_dir, model_key)
+        if backend == "onnx":
+            if device != "cpu":
+                raise RuntimeError("the ONNX backend is meant for CPU-only hosts")
+            return OnnxEncoder(model, device, quantize, cache_dir, model_key, num_threads)
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(INFERENCE_BACKENDS)})")
+    except Exception as e:
+        print(f"⚠️  Could not set up {backend} inference backend ({e}); using stock PyTorch")
+        return TorchEncoder(model, device)
+
+
+def check_accuracy(reference, candidate, images: Optional[torch.Tensor], texts=None, tokenize=None) -> dict:
+    """
+    Compare a candidate encoder's embeddings against the reference encoder on a sample:
+    cosine similarity per embedding (1.0 = identical) and top-1 text->image agreement.
+    """
+    texts = texts or ACCURACY_CHECK_TEXTS
+    tokens = tokenize(texts)
+    reference_text = reference.encode_texts(tokens)
+    candidate_text = candidate.encode_texts(tokens)
+    text_cosine = np.sum(reference_text * candidate_text, axis=1)
+    report = {
+        "backend": candidate.name,
+        "text_samples": len(texts),
+        "text_min_cosine": float(text_cosine.min()),
+        "text_mean_cosine": float(text_cosine.mean()),
+    }
+
+    if images is not None and len(images) > 0:
+        reference_images = reference.encode_images(images)
+        candidate_images = candidate.encode_images(images)
+        image_cosine = np.sum(reference_images * candidate_images, axis=1)
+        report.update({
+            "image_samples": len(images),
+            "image_min_cosine": float(image_cosine.min()),
+            "image_mean_cosine": float(image_cosine.mean()),
+            # Does each prompt still pick the same best-matching sample image?
+            "top1_agreement": float(np.mean(
+                np.argmax(reference_text @ reference_images.T, axis=1) == np.argmax(candidate_text @ candidate_images.T, axis=1)
+            )),
+        })
+
+    report["min_cosine"] = min(report["text_min_cosine"], report.get("image_min_cosine", 1.0))
+    return report
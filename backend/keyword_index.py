@@ -0,0 +1,204 @@
+import os
+import re
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Runs of CJK characters (kana, ideographs, hangul) have no word breaks and are indexed as bigrams
+CJK = "぀-ヿ㐀-䶿一-鿿가-힯"
+TOKEN_PATTERN = re.compile(rf"[0-9]+|[{CJK}]+|[^\W\d_{CJK}]+")
+CJK_PATTERN = re.compile(rf"[{CJK}]")
+
+# File extensions and camera file-name prefixes that appear in nearly every path and carry no meaning
+STOP_TOKENS = frozenset({
+    "jpg", "jpeg", "png", "gif", "bmp", "webp", "tif", "tiff", "heic",
+    "img", "dsc", "dscn", "dscf", "pxl", "photo", "photos", "image", "images",
+})
+
+# Caption sidecars read by read_caption
+SIDECAR_EXTENSIONS = (".txt", ".xmp")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word, number and CJK-bigram tokens: "Kyoto2023/京都旅行/IMG_0042.jpg" ->
+    kyoto, 2023, 京都, 都旅, 旅行, 0042. CamelCase and letter/digit boundaries split words.
+    """
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text).lower()
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text):
+        if CJK_PATTERN.match(run):
+            tokens.extend(run[i:i + 2] for i in range(max(1, len(run) - 1)))
+        elif run not in STOP_TOKENS:
+            tokens.append(run)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    Inverted index from tokens to embedding rows, stored as CSR arrays (sorted vocabulary, offsets, postings).
+    A query's keyword score per row is the BM25 idf of the query tokens the row contains, divided by the idf
+    of all query tokens known to the index, so a row matching every known token scores 1.
+    """
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray, postings: np.ndarray, n_rows: int):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.postings = postings
+        self.n_rows = n_rows
+        self._token_ids: Dict[str, int] = {str(token): i for i, token in enumerate(tokens)}
+        document_frequency = np.diff(offsets).astype(np.float32)
+        self.idf = np.log((n_rows - document_frequency + 0.5) / (document_frequency + 0.5) + 1.0).astype(np.float32)
+
+    @classmethod
+    def build(cls, documents: Iterable[str]) -> "KeywordIndex":
+        """Index one text per row (e.g. relative path plus caption)"""
+        postings: Dict[str, List[int]] = {}
+        n_rows = 0
+        for row, text in enumerate(documents):
+            n_rows = row + 1
+            for token in set(tokenize(text)):
+                postings.setdefault(token, []).append(row)
+
+        tokens = sorted(postings)
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[token]) for token in tokens])
+        rows = np.fromiter(chain.from_iterable(postings[token] for token in tokens), dtype=np.int32, count=int(offsets[-1]))
+        return cls(np.array(tokens, dtype=str), offsets, rows, n_rows)
+
+    def update(self, kept_rows: np.ndarray, documents: Iterable[str]) -> "KeywordIndex":
+        """
+        Index after an incremental reindex: rows not in kept_rows (sorted old rows) are dropped, the kept rows
+        are renumbered 0..k-1 and one new row per document is appended. Only the new documents are tokenized.
+        """
+        kept_rows = np.asarray(kept_rows, dtype=np.int64)
+        remap = np.full(self.n_rows, -1, dtype=np.int64)
+        remap[kept_rows] = np.arange(len(kept_rows))
+        added = KeywordIndex.build(documents)
+
+        # (token, row) pairs of both indexes over the merged vocabulary
+        tokens = np.union1d(self.tokens, added.tokens)
+        old_rows = remap[self.postings]
+        keep = old_rows >= 0
+        old_tokens = np.repeat(np.searchsorted(tokens, self.tokens), np.diff(self.offsets))[keep]
+        new_tokens = np.repeat(np.searchsorted(tokens, added.tokens), np.diff(added.offsets))
+        token_ids = np.concatenate([old_tokens, new_tokens])
+        rows = np.concatenate([old_rows[keep], added.postings.astype(np.int64) + len(kept_rows)])
+        # Stable sort by token: the rows of each token stay ascending (old rows first, new rows are larger)
+        order = np.argsort(token_ids, kind="stable")
+        counts = np.bincount(token_ids, minlength=len(tokens))
+
+        # Tokens only found in dropped rows leave the vocabulary
+        used = counts > 0
+        offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[used])
+        return KeywordIndex(tokens[used], offsets, rows[order].astype(np.int32), len(kept_rows) + added.n_rows)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, tokens=self.tokens, offsets=self.offsets, postings=self.postings, n_rows=np.int64(self.n_rows))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["KeywordIndex"]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data["tokens"], data["offsets"], data["postings"], int(data["n_rows"]))
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def score(self, query: str, max_rows: int = 0, max_postings: int = 0) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (rows, scores in (0, 1]) of the rows matching any query token, rows sorted ascending; None if no
+        token of the query is in the index. With max_rows, only the best-scoring rows are kept. With
+        max_postings, tokens are merged rarest first until their postings would exceed it; the common
+        tokens left out (e.g. "2023" in a library sorted by year) carry little idf weight anyway. If even
+        the rarest token exceeds it, a sample of max_postings of its rows is scored.
+        """
+        token_ids = sorted({self._token_ids[token] for token in tokenize(query) if token in self._token_ids})
+        if not token_ids:
+            return None
+        total_idf = float(self.idf[token_ids].sum())
+
+        sample = None
+        if max_postings:
+            selected, budget = [], max_postings
+            for token_id in sorted(token_ids, key=lambda t: self.offsets[t + 1] - self.offsets[t]):
+                length = int(self.offsets[token_id + 1] - self.offsets[token_id])
+                if length > budget:
+                    break
+                selected.append(token_id)
+                budget -= length
+            if not selected:
+                # Even the rarest token is too common: keep an evenly spaced sample of its postings,
+                # rather than silently turning the query into a pure vector search
+                token_id = min(token_ids, key=lambda t: self.offsets[t + 1] - self.offsets[t])
+                postings = self.postings[self.offsets[token_id]:self.offsets[token_id + 1]]
+                sample = postings[np.linspace(0, len(postings) - 1, max_postings).astype(np.int64)]
+                selected = [token_id]
+            token_ids = sorted(selected)
+
+        if sample is not None:
+            rows, weights = sample, np.full(len(sample), self.idf[token_ids[0]], dtype=np.float32)
+        else:
+            starts, ends = self.offsets[token_ids], self.offsets[np.asarray(token_ids) + 1]
+            rows = np.concatenate([self.postings[start:end] for start, end in zip(starts, ends)])
+            weights = np.repeat(self.idf[token_ids], ends - starts)
+        # Sum the weights per row: sort by row and add up each run
+        order = np.argsort(rows, kind="stable")
+        rows, weights = rows[order], weights[order]
+        run_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        rows = rows[run_starts].astype(np.int64)
+        scores = np.add.reduceat(weights, run_starts) / total_idf
+
+        if max_rows and len(rows) > max_rows:
+            best = np.sort(np.argpartition(scores, len(scores) - max_rows)[len(scores) - max_rows:])
+            rows, scores = rows[best], scores[best]
+        return rows, scores.astype(np.float32)
+
+
+def sidecar_paths(image_path: str, extension: str) -> Tuple[str, str]:
+    """Possible sidecars of an image with the given extension: photo.jpg.txt, then photo.txt"""
+    return f"{image_path}{extension}", f"{os.path.splitext(image_path)[0]}{extension}"
+
+
+def sidecar_mtime_ns(image_path: str) -> Optional[int]:
+    """Newest mtime of the image's sidecars, None if it has none (compared to detect caption edits)"""
+    mtimes = []
+    for extension in SIDECAR_EXTENSIONS:
+        for sidecar in sidecar_paths(image_path, extension):
+            try:
+                mtimes.append(os.stat(sidecar).st_mtime_ns)
+            except OSError:
+                continue
+    return max(mtimes) if mtimes else None
+
+
+def read_caption(image_path: str) -> Optional[str]:
+    """
+    Caption text from a sidecar next to the image: photo.jpg.txt or photo.txt (plain text), or
+    photo.jpg.xmp / photo.xmp (title, description and keywords)
+    """
+    for sidecar in sidecar_paths(image_path, ".txt"):
+        if os.path.isfile(sidecar):
+            with open(sidecar, "r", encoding="utf-8", errors="replace") as f:
+                return f.read().strip() or None
+    for sidecar in sidecar_paths(image_path, ".xmp"):
+        if os.path.isfile(sidecar):
+            with open(sidecar, "r", encoding="utf-8", errors="replace") as f:
+                xmp = f.read()
+            fields = re.findall(r"<dc:(title|description|subject)\b[^>]*>(.*?)</dc:\1>", xmp, flags=re.DOTALL)
+            text = " ".join(re.sub(r"<[^>]+>", " ", value) for _, value in fields)
+            return " ".join(text.split()) or None
+    return None
+
+
+def keyword_documents(paths: Iterable[str], captions: Iterable[Optional[str]], root: str) -> Iterable[str]:
+    """Indexed text per row: the path relative to the library (folders and file name) plus the caption"""
+    for path, caption in zip(paths, captions):
+        relative = os.path.relpath(path, root) if os.path.isabs(path) and path.startswith(root) else path
+        yield f"{relative} {caption}" if caption else relative
+
@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class ScannedFile(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    # Newest mtime of the file's sidecars (photo.jpg.txt, photo.txt, ...), None without sidecars
+    sidecar_mtime_ns: Optional[int] = None
+
+
+def _scan_directory(
+    directory: str, extensions: frozenset, sidecar_extensions: frozenset = frozenset()
+) -> Tuple[List[ScannedFile], List[str]]:
+    """One os.scandir pass over a directory: matching files with their stat info, plus subdirectories"""
+    files, subdirectories = [], []
+    sidecars: Dict[str, int] = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    # Symlinked directories are not followed, so links cannot create cycles
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                        continue
+                    extension = os.path.splitext(entry.name)[1].lower()
+                    if extension in extensions and entry.is_file():
+                        stat = entry.stat()
+                        files.append(ScannedFile(entry.path, stat.st_size, stat.st_mtime_ns))
+                    elif extension in sidecar_extensions and entry.is_file():
+                        sidecars[entry.name] = entry.stat().st_mtime_ns
+                except OSError:
+                    # Vanished or unreadable entry: skip it, the rest of the directory is still fine
+                    continue
+    except OSError as e:
+        print(f"⚠️  Cannot scan {directory}: {e}")
+
+    if sidecars:
+        # Sidecars sit next to their file, named after the full file name or its stem
+        for i, scanned in enumerate(files):
+            name = os.path.basename(scanned.path)
+            stem = os.path.splitext(name)[0]
+            mtimes = [
+                sidecars[sidecar]
+                for extension in sidecar_extensions
+                for sidecar in (f"{name}{extension}", f"{stem}{extension}")
+                if sidecar in sidecars
+            ]
+            if mtimes:
+                files[i] = scanned._replace(sidecar_mtime_ns=max(mtimes))
+    return files, subdirectories
+
+
+def scan_library(
+    root: str, extensions: Iterable[str], num_workers: int = 8, sidecar_extensions: Iterable[str] = ()
+) -> Iterator[ScannedFile]:
+    """
+    Walk the tree under root once, yielding every file whose extension matches (case-insensitively)
+    together with its size and mtime (and the newest mtime of its sidecars, given sidecar_extensions).
+    Directories are listed in parallel by a thread pool, which hides per-directory latency on network
+    mounts, and files are yielded as soon as their directory has been listed, so consumers can start
+    work before the scan finishes. Order is not deterministic.
+    """
+    if not os.path.isdir(root):
+        return
+    extensions = frozenset(extension.lower() for extension in extensions)
+    sidecar_extensions = frozenset(extension.lower() for extension in sidecar_extensions)
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix="scan") as executor:
+        pending = {executor.submit(_scan_directory, root, extensions, sidecar_extensions)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirectories = future.result()
+                    pending |= {executor.submit(_scan_directory, subdirectory, extensions, sidecar_extensions) for subdirectory in subdirectories}
+                    yield from files
+        finally:
+            # Consumer stopped early (e.g. a cancelled reindex): drop directories not yet listed
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,163 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Set, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # optional dependency: fall back to polling
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Forwards watchdog events to the LibraryWatcher"""
+
+    def __init__(self, watcher: "LibraryWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            # A directory was moved or removed: its files may not get individual events
+            if event.event_type in ("moved", "deleted"):
+                self.watcher.request_rescan()
+            return
+
+        if event.event_type in ("created", "modified", "closed"):
+            self.watcher.record(changed=event.src_path)
+        elif event.event_type == "deleted":
+            self.watcher.record(deleted=event.src_path)
+        elif event.event_type == "moved":
+            self.watcher.record(deleted=event.src_path)
+            self.watcher.record(changed=event.dest_path)
+
+
+class LibraryWatcher:
+    """
+    Watches the photo library (inotify/FSEvents via watchdog when installed, polling otherwise)
+    and hands debounced batches of changed and deleted files (those accepted by is_watched) to a callback. Batches are at least
+    min_interval_seconds apart, so a steady trickle of new files doesn't rewrite the index every few seconds.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        is_watched: Callable[[str], bool],
+        on_changes: Callable[[Set[str], Set[str]], None],
+        on_rescan: Callable[[], None],
+        snapshot: Callable[[], Dict[str, Tuple]],
+        debounce_seconds: float = 2.0,
+        min_interval_seconds: float = 0.0,
+        poll_interval: float = 30.0,
+        force_polling: bool = False,
+    ):
+        self.root = root
+        self.is_watched = is_watched
+        self.on_changes = on_changes
+        self.on_rescan = on_rescan
+        self.snapshot = snapshot
+        self.debounce_seconds = debounce_seconds
+        self.min_interval_seconds = min_interval_seconds
+        self.poll_interval = poll_interval
+        self.mode = "polling" if force_polling or Observer is None else "events"
+
+        self._changed: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._rescan = False
+        self._last_event = 0.0
+        self._last_flush = float("-inf")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._threads = []
+
+    def start(self):
+        if self.mode == "events":
+            self._observer = Observer()
+            self._observer.schedule(_EventHandler(self), self.root, recursive=True)
+            self._observer.start()
+        else:
+            self._start_thread(self._poll_loop, "library-poller")
+        self._start_thread(self._flush_loop, "library-watcher")
+        print(f"Watching {self.root} for changes ({self.mode})")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+    def _start_thread(self, target, name: str):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def record(self, changed: Optional[str] = None, deleted: Optional[str] = None):
+        with self._lock:
+            if changed is not None and self.is_watched(changed):
+                self._changed.add(changed)
+                self._deleted.discard(changed)
+            if deleted is not None and self.is_watched(deleted):
+                self._deleted.add(deleted)
+                self._changed.discard(deleted)
+            self._last_event = time.monotonic()
+        self._wakeup.set()
+
+    def request_rescan(self):
+        with self._lock:
+            self._rescan = True
+            self._last_event = time.monotonic()
+        self._wakeup.set()
+
+    def _flush_loop(self):
+        """
+        Wait until events stop arriving for debounce_seconds and min_interval_seconds have passed since the
+        last batch, then apply them in one batch
+        """
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while not self._stop.is_set():
+                with self._lock:
+                    now = time.monotonic()
+                    wait = max(
+                        self.debounce_seconds - (now - self._last_event),
+                        self.min_interval_seconds - (now - self._last_flush),
+                    )
+                if wait <= 0:
+                    break
+                self._stop.wait(wait)
+            if self._stop.is_set():
+                return
+            self._last_flush = time.monotonic()
+
+            with self._lock:
+                changed, deleted, rescan = self._changed, self._deleted, self._rescan
+                self._changed, self._deleted, self._rescan = set(), set(), False
+
+            try:
+                if rescan:
+                    self.on_rescan()
+                elif changed or deleted:
+                    self.on_changes(changed, deleted)
+            except Exception as e:
+                print(f"Error applying library changes: {e}")
+
+    def _poll_loop(self):
+        """Polling fallback: diff snapshots of the library (per-file signatures such as size and mtime)"""
+        previous = self.snapshot()
+        while not self._stop.wait(self.poll_interval):
+            try:
+                current = self.snapshot()
+            except Exception as e:
+                print(f"Error scanning library: {e}")
+                continue
+            for path, signature in current.items():
+                if previous.get(path) != signature:
+                    self.record(changed=path)
+            for path in previous.keys() - current.keys():
+                self.record(deleted=path)
+            previous = current
@@ -1,11 +1,17 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Form, HTTPException, Response, UploadFile
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from typing import Iterable, Iterator, List, Literal, Optional, Set, Tuple, Union
+from datetime import date
 import os
+import io
 import json
+import hashlib
+import threading
 from pathlib import Path
 import numpy as np
 from PIL import Image
@@ -13,6 +19,24 @@ import torch
 import clip
 import urllib.parse
 
+from ann_index import IVFIndex
+from catalog import ImageCatalog, ImageRecord, read_image_records, update_catalog, write_catalog
+from embedding_index import EmbeddingIndex
+from quantization import build_quantizer, load_quantizer, save_quantizer
+from fast_preprocess import FastClipPreprocess
+from image_pipeline import encode_image_batches
+from inference import TorchEncoder, check_accuracy, create_encoder
+from keyword_index import SIDECAR_EXTENSIONS, KeywordIndex, keyword_documents, sidecar_mtime_ns
+from library_scanner import ScannedFile, scan_library
+from library_watcher import LibraryWatcher
+from metrics import INDEX_FAILURES, INDEXED_IMAGES, REGISTRY, MetricsMiddleware, current_stage_timings, timed
+from profiling import ProfilingMiddleware
+from query_batcher import QueryBatcher
+from reindex_job import ReindexJob
+from sharding import ShardClient, merge_top_k, shard_for_path
+from text_cache import TextEmbeddingCache, normalize_query
+from thumbnails import ThumbnailCache
+
 app = FastAPI(title="Photo Search API")
 
 # Enable CORS
@@ -23,167 +47,1061 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Request counts and latency per route for /metrics, and per-stage Server-Timing headers
+app.add_middleware(MetricsMiddleware)
+# Opt-in profiling of single requests (X-Profile: 1 header or ?profile=1); dumps are written to PROFILE_DIR
+if os.getenv("PROFILING_ENABLED", "0") == "1":
+    app.add_middleware(ProfilingMiddleware, profile_dir=os.getenv("PROFILE_DIR", "profiles"))
 
 # Global variables for models
 clip_model = None
 clip_preprocess = None
+image_preprocess = None  # preprocess used for encoding: CLIP's own, or the reduced-resolution fast path
+fast_decode_accuracy = None  # result of the fast decode path's check against the reference preprocess
 device = None
+clip_encoder = None  # selected inference backend for both towers (see INFERENCE_BACKEND)
+inference_accuracy = None  # result of the optional accuracy check against the stock model
+model_status = "pending"  # pending, loading, ready or failed; the model loads in the background at startup
+
+# In-memory embedding index, loaded at startup and swapped in after each reindex
+embedding_index: Optional[EmbeddingIndex] = None
+index_status = "pending"  # pending, loading, loaded, missing or mismatched; loaded in the background at startup
+index_metadata: dict = {}  # contents of image_index.json for the loaded index, read once per load
+
+# Background reindexing: latest job, and a lock so only one indexing pass runs at a time
+reindex_job: Optional[ReindexJob] = None
+reindex_job_lock = threading.Lock()
+indexing_lock = threading.Lock()
+
+# Filesystem watcher (only when WATCH_LIBRARY=1)
+library_watcher: Optional[LibraryWatcher] = None
+
+# Micro-batcher for /search (only when QUERY_BATCHING=1 and not running as coordinator)
+query_batcher: Optional[QueryBatcher] = None
 
 # Configuration
 # Default to test_photos directory for Flickr30k dataset
 # Can be overridden with PHOTO_LIBRARY_PATH environment variable
 DEFAULT_PHOTO_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "test_photos")
 PHOTO_LIBRARY_PATH = os.getenv("PHOTO_LIBRARY_PATH", DEFAULT_PHOTO_PATH)
-INDEX_FILE = "image_index.json"
-EMBEDDINGS_FILE = "image_embeddings.npy"
-IMAGE_PATHS_FILE = "image_paths.json"
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "ViT-B/32")
+# Inference backend for the CLIP towers: torch (stock), torchscript or onnx (needs onnxruntime),
+# optionally with int8 dynamic quantization and a fixed intra-op thread count (0 = library default)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+INFERENCE_INT8 = os.getenv("INFERENCE_INT8", "0") == "1"
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+INFERENCE_CACHE_DIR = os.getenv("INFERENCE_CACHE_DIR", "inference_cache")
+# Compare the optimized backend against the stock model on a sample at startup; fall back if it drifts
+INFERENCE_ACCURACY_CHECK = os.getenv("INFERENCE_ACCURACY_CHECK", "1") == "1"
+INFERENCE_CHECK_SAMPLES = int(os.getenv("INFERENCE_CHECK_SAMPLES", "16"))
+INFERENCE_MIN_COSINE = float(os.getenv("INFERENCE_MIN_COSINE", "0.99"))
+# Decode JPEGs at reduced resolution (libjpeg DCT scaling) and preprocess in NumPy; checked against
+# CLIP's reference preprocessing on a sample at startup and disabled if embeddings drift
+FAST_DECODE = os.getenv("FAST_DECODE", "1") == "1"
+FAST_DECODE_MIN_COSINE = float(os.getenv("FAST_DECODE_MIN_COSINE", "0.99"))
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
+# Sharding: this backend indexes only the images hashed to SHARD_ID out of SHARD_COUNT shards
+# (by full path, or by top-level folder with SHARD_BY=directory). With SHARD_URLS set it instead
+# runs as a coordinator that fans queries out to those shard backends and merges their results.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_ID = int(os.getenv("SHARD_ID", "0"))
+SHARD_BY = os.getenv("SHARD_BY", "hash")
+SHARD_URLS = [url for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", "5"))
+INDEX_PREFIX = f"shard{SHARD_ID}of{SHARD_COUNT}_" if SHARD_COUNT > 1 else ""
+INDEX_FILE = f"{INDEX_PREFIX}image_index.json"
+EMBEDDINGS_FILE = f"{INDEX_PREFIX}image_embeddings.npy"
+# On-disk embedding storage: float16 halves disk and RAM; the file is memory-mapped at load time
+EMBEDDINGS_DTYPE = os.getenv("EMBEDDINGS_DTYPE", "float32")
+EMBEDDINGS_MMAP = os.getenv("EMBEDDINGS_MMAP", "1") == "1"
+IMAGE_PATHS_FILE = f"{INDEX_PREFIX}image_paths.json"
+# Per-file size/mtime (and optional content hash) used for incremental reindexing
+IMAGE_MANIFEST_FILE = f"{INDEX_PREFIX}image_manifest.json"
+INDEX_CONTENT_HASH = os.getenv("INDEX_CONTENT_HASH", "0") == "1"
+# SQLite catalog of per-image metadata (size, mtime, dimensions, EXIF date/camera), row ids = embedding rows
+CATALOG_FILE = f"{INDEX_PREFIX}image_catalog.db"
+# Inverted index from path/caption tokens to rows; hybrid search adds weighted keyword matches to CLIP scores
+KEYWORD_INDEX_FILE = f"{INDEX_PREFIX}image_keywords.npz"
+HYBRID_KEYWORD_WEIGHT = float(os.getenv("HYBRID_KEYWORD_WEIGHT", "0.1"))
+HYBRID_MAX_CANDIDATES = int(os.getenv("HYBRID_MAX_CANDIDATES", "4096"))  # best keyword matches fused per query
+HYBRID_MAX_POSTINGS = int(os.getenv("HYBRID_MAX_POSTINGS", "65536"))  # postings merged per query (rarest tokens first)
+# Approximate nearest-neighbour (IVF) index, built for libraries of at least ANN_MIN_IMAGES
+ANN_INDEX_FILE = f"{INDEX_PREFIX}image_ivf_index.npz"
+ANN_MIN_IMAGES = int(os.getenv("ANN_MIN_IMAGES", "50000"))
+ANN_NLISTS = int(os.getenv("ANN_NLISTS", "0"))  # 0 = about sqrt(number of images)
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))  # default lists scanned per query
+# Compressed embedding codes scored in RAM, with the top candidates re-ranked on the full vectors
+COMPRESSED_CODES_FILE = f"{INDEX_PREFIX}image_embeddings_codes.npz"
+INDEX_COMPRESSION = os.getenv("INDEX_COMPRESSION", "none")  # none, sq8 (8-bit scalar) or pq (product quantization)
+PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "64"))
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "256"))
+# Indexing pipeline: images per encode_image call and decode/preprocess worker processes
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "32"))
+INDEX_NUM_WORKERS = int(os.getenv("INDEX_NUM_WORKERS", str(max(1, (os.cpu_count() or 1) - 1))))
+# Rows copied at a time when the embeddings file is rewritten
+SAVE_CHUNK_ROWS = 65536
+# Threads listing directories during the library scan (I/O bound: more helps on network mounts)
+SCAN_NUM_WORKERS = int(os.getenv("SCAN_NUM_WORKERS", "8"))
+# LRU cache of text query embeddings (0 disables it)
+TEXT_CACHE_SIZE = int(os.getenv("TEXT_CACHE_SIZE", "1024"))
+# Thumbnails served by /image?size=..., cached on disk with a size budget
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", "thumbnail_cache")
+THUMBNAIL_CACHE_MAX_MB = int(os.getenv("THUMBNAIL_CACHE_MAX_MB", "1024"))
+THUMBNAILS_ON_INDEX = os.getenv("THUMBNAILS_ON_INDEX", "0") == "1"  # pre-generate while indexing
+THUMBNAIL_INDEX_SIZE = int(os.getenv("THUMBNAIL_INDEX_SIZE", "512"))
+# Optional live index updates from filesystem events (inotify via watchdog, or polling)
+WATCH_LIBRARY = os.getenv("WATCH_LIBRARY", "0") == "1"
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+# Minimum time between two index updates; events arriving meanwhile are applied together
+WATCH_MIN_INTERVAL_SECONDS = float(os.getenv("WATCH_MIN_INTERVAL_SECONDS", "30"))
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "30"))
+WATCH_FORCE_POLLING = os.getenv("WATCH_FORCE_POLLING", "0") == "1"
+# Dynamic micro-batching of concurrent /search requests (one text-encoder batch and one matmul per batch)
+QUERY_BATCHING = os.getenv("QUERY_BATCHING", "1") == "1"
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+
+text_embedding_cache = TextEmbeddingCache(TEXT_CACHE_SIZE)
+shard_client = ShardClient(SHARD_URLS, timeout=SHARD_TIMEOUT) if SHARD_URLS else None
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_MB * 1024 * 1024)
 
 class SearchRequest(BaseModel):
     query: str
     limit: int = 20
     threshold: float = 0.0  # Minimum similarity score threshold
     use_threshold: bool = False  # Whether to use threshold filtering
+    nprobe: Optional[int] = None  # ANN lists to scan (higher = better recall, slower); defaults to ANN_NPROBE
+    exact: bool = False  # Force exact brute-force search even if an ANN index exists
+    # Metadata filters, applied in the catalog before scoring so only matching images are ranked
+    taken_after: Optional[date] = None  # EXIF capture date, inclusive
+    taken_before: Optional[date] = None  # inclusive
+    folder: Optional[str] = None  # folder prefix, absolute or relative to the photo library
+    camera: Optional[str] = None  # EXIF camera, e.g. "Canon EOS R5" (case-insensitive)
+    # "hybrid" adds keyword matches in folder/file names and captions to the CLIP similarity
+    mode: Literal["vector", "hybrid"] = "vector"
+    keyword_weight: Optional[float] = None  # score added for matching every query keyword; defaults to HYBRID_KEYWORD_WEIGHT
 
 class SearchResult(BaseModel):
     path: str
     score: float
 
+class VectorSearchRequest(BaseModel):
+    embedding: List[float]  # normalized query embedding
+    limit: int = 20
+    threshold: float = 0.0
+    use_threshold: bool = False
+    nprobe: Optional[int] = None
+    exact: bool = False
+    exclude_path: Optional[str] = None  # e.g. the photo a similarity query started from
+    taken_after: Optional[date] = None
+    taken_before: Optional[date] = None
+    folder: Optional[str] = None
+    camera: Optional[str] = None
+
 def initialize_models():
     """Initialize CLIP model for image-text matching"""
-    global clip_model, clip_preprocess, device
+    global clip_model, clip_preprocess, device, clip_encoder, image_preprocess
     
     if clip_model is None:
         print("Loading CLIP model...")
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        clip_model, clip_preprocess = clip.load("ViT-B/32", device=device)
+        clip_model, clip_preprocess = clip.load(CLIP_MODEL_NAME, device=device)
         clip_model.eval()
         print(f"CLIP model loaded on {device}")
+        
+        clip_encoder = create_encoder(
+            INFERENCE_BACKEND,
+            clip_model,
+            device,
+            quantize=INFERENCE_INT8,
+            num_threads=INFERENCE_THREADS,
+            cache_dir=INFERENCE_CACHE_DIR,
+            model_name=CLIP_MODEL_NAME,
+        )
+        if clip_encoder.name != "torch" and INFERENCE_ACCURACY_CHECK:
+            verify_inference_backend()
+        print(f"Using {clip_encoder.name} inference backend")
+        
+        image_preprocess = clip_preprocess
+        if FAST_DECODE:
+            verify_fast_decode(FastClipPreprocess(clip_model.visual.input_resolution))
+        # Cached query embeddings are only valid for the model that produced them
+        text_embedding_cache.set_model(f"{CLIP_MODEL_NAME}@{device}/{clip_encoder.name}")
+
+def accuracy_sample_paths(limit: int) -> List[str]:
+    """The first few image files in the library, for the accuracy checks"""
+    paths = []
+    for root, _, files in os.walk(PHOTO_LIBRARY_PATH):
+        paths.extend(os.path.join(root, name) for name in sorted(files) if is_image_file(name))
+        if len(paths) >= limit:
+            break
+    return paths[:limit]
+
+def accuracy_sample_images(paths: List[str], preprocess=None) -> Optional[torch.Tensor]:
+    """Preprocessed tensor of the readable sample images (CLIP's reference preprocessing by default)"""
+    tensors = []
+    for path in paths:
+        try:
+            if preprocess is None:
+                tensors.append(clip_preprocess(Image.open(path).convert('RGB')))
+            else:
+                tensors.append(preprocess.load(path))
+        except Exception:
+            continue
+    return torch.stack(tensors) if tensors else None
+
+def verify_inference_backend():
+    """Compare the optimized encoder with the stock model; fall back to stock PyTorch if embeddings drift"""
+    global clip_encoder, inference_accuracy
+    
+    inference_accuracy = check_accuracy(
+        TorchEncoder(clip_model, device),
+        clip_encoder,
+        accuracy_sample_images(accuracy_sample_paths(INFERENCE_CHECK_SAMPLES)),
+        tokenize=clip.tokenize,
+    )
+    print(f"Inference accuracy check: {inference_accuracy}")
+    if inference_accuracy["min_cosine"] < INFERENCE_MIN_COSINE:
+        print(f"⚠️  {clip_encoder.name} embeddings differ from the reference model "
+              f"(min cosine {inference_accuracy['min_cosine']:.4f} < {INFERENCE_MIN_COSINE}); using stock PyTorch")
+        clip_encoder = TorchEncoder(clip_model, device)
+
+def verify_fast_decode(fast_preprocess: FastClipPreprocess):
+    """Use the fast decode path only if its embeddings match the reference preprocessing on a sample"""
+    global image_preprocess, fast_decode_accuracy
+    
+    # Only files both paths can read, so the two tensors stay row-aligned
+    paths = []
+    for path in accuracy_sample_paths(INFERENCE_CHECK_SAMPLES):
+        try:
+            with Image.open(path) as image:
+                image.verify()
+            paths.append(path)
+        except Exception:
+            continue
+    if not paths:
+        print("Fast decode enabled (no sample images to check it against yet)")
+        image_preprocess = fast_preprocess
+        return
+    
+    reference = encode_image_tensor(accuracy_sample_images(paths))
+    fast = encode_image_tensor(accuracy_sample_images(paths, fast_preprocess))
+    cosine = np.sum(reference * fast, axis=1)
+    fast_decode_accuracy = {
+        "samples": len(paths),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+    }
+    print(f"Fast decode accuracy check: {fast_decode_accuracy}")
+    if fast_decode_accuracy["min_cosine"] < FAST_DECODE_MIN_COSINE:
+        print(f"⚠️  Fast decode embeddings differ from the reference preprocessing "
+              f"(min cosine {fast_decode_accuracy['min_cosine']:.4f} < {FAST_DECODE_MIN_COSINE}); decoding at full resolution")
+        return
+    image_preprocess = fast_preprocess
+
+def load_image_tensor(source) -> torch.Tensor:
+    """Decode and preprocess an image file (path or file object) into a CHW tensor"""
+    with timed("image_preprocess"):
+        if isinstance(image_preprocess, FastClipPreprocess):
+            return image_preprocess.load(source)
+        return image_preprocess(Image.open(source).convert('RGB'))
+
+def is_image_file(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+def is_own_shard(path: str) -> bool:
+    """Whether this backend indexes the given image (always true without sharding)"""
+    return SHARD_COUNT <= 1 or shard_for_path(path, SHARD_COUNT, PHOTO_LIBRARY_PATH, by=SHARD_BY) == SHARD_ID
+
+def scan_image_files(directory: str) -> Iterator[ScannedFile]:
+    """
+    Stream (path, size, mtime_ns, sidecar_mtime_ns) of every image under directory from a single
+    parallel scandir walk
+    """
+    return scan_library(directory, IMAGE_EXTENSIONS, num_workers=SCAN_NUM_WORKERS, sidecar_extensions=SIDECAR_EXTENSIONS)
+
+def is_sidecar_file(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in SIDECAR_EXTENSIONS
+
+def images_of_sidecar(sidecar: str) -> List[str]:
+    """Images a caption sidecar belongs to: photo.jpg for photo.jpg.txt, any photo.* image for photo.txt"""
+    base = os.path.splitext(sidecar)[0]
+    if is_image_file(base):
+        return [base]
+    directory, stem = os.path.split(base)
+    try:
+        names = os.listdir(directory or ".")
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in names if is_image_file(name) and os.path.splitext(name)[0] == stem]
 
 def get_image_files(directory: str) -> List[str]:
     """Recursively get all image files from directory"""
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.tif'}
-    image_files = []
-    
-    directory_path = Path(directory)
-    if not directory_path.exists():
-        return image_files
+    with timed("library_scan"):
+        return [scanned.path for scanned in scan_image_files(directory)]
+
+def encode_image_tensor(image_tensor: torch.Tensor) -> np.ndarray:
+    """Encode a batch of preprocessed images into normalized CLIP embeddings"""
+    with timed("image_encode"):
+        return clip_encoder.encode_images(image_tensor)
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """Encode a batch of query texts into normalized CLIP embeddings"""
+    with timed("text_encode"):
+        return clip_encoder.encode_texts(clip.tokenize(texts))
+
+def get_text_embeddings(queries: List[str]) -> np.ndarray:
+    """Embeddings for several queries: cache hits are reused, misses are encoded in a single batch"""
+    embeddings = [text_embedding_cache.get(query) for query in queries]
     
-    for ext in image_extensions:
-        image_files.extend(directory_path.rglob(f"*{ext}"))
-        image_files.extend(directory_path.rglob(f"*{ext.upper()}"))
+    # Encode each distinct missing query once
+    missing = {}
+    for query, embedding in zip(queries, embeddings):
+        if embedding is None:
+            missing.setdefault(normalize_query(query), query)
+    if missing:
+        encoded = dict(zip(missing.keys(), encode_texts(list(missing.values()))))
+        for key, query in missing.items():
+            text_embedding_cache.put(query, encoded[key])
+        embeddings = [
+            embedding if embedding is not None else encoded[normalize_query(query)]
+            for query, embedding in zip(queries, embeddings)
+        ]
     
-    return [str(f) for f in image_files]
+    return np.stack(embeddings)
+
+def get_text_embedding(query: str) -> np.ndarray:
+    """Embedding for a single query, served from the LRU cache when possible"""
+    return get_text_embeddings([query])[0]
 
 def compute_image_embedding(image_path: str) -> Optional[np.ndarray]:
     """Compute CLIP embedding for an image"""
     try:
-        image = Image.open(image_path).convert('RGB')
-        image_tensor = clip_preprocess(image).unsqueeze(0).to(device)
-        
-        with torch.no_grad():
-            image_features = clip_model.encode_image(image_tensor)
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-        
-        return image_features.cpu().numpy().flatten()
+        image_tensor = load_image_tensor(image_path).unsqueeze(0)
+        return encode_image_tensor(image_tensor).flatten()
     except Exception as e:
         print(f"Error processing {image_path}: {e}")
         return None
 
-def index_images(force_reindex: bool = False, check_new_images: bool = False):
-    """Index all images in the photo library"""
+def load_index(valid_mask: Optional[np.ndarray] = None):
+    """
+    Load the on-disk index into memory, replacing the current one. A valid_mask already known for the
+    rows (e.g. right after saving them) skips checking every file on disk.
+    """
+    global embedding_index, index_metadata, index_status
+    
+    try:
+        with timed("index_load"):
+            new_index = EmbeddingIndex.load(
+                EMBEDDINGS_FILE,
+                IMAGE_PATHS_FILE,
+                ANN_INDEX_FILE,
+                mmap=EMBEDDINGS_MMAP,
+                codes_file=COMPRESSED_CODES_FILE if INDEX_COMPRESSION != "none" else None,
+                valid_mask=valid_mask,
+            )
+        if new_index is not None:
+            new_index.rerank_candidates = RERANK_CANDIDATES
+            new_index.catalog = open_catalog(len(new_index))
+            new_index.keywords = open_keyword_index(len(new_index))
+    except Exception as e:
+        print(f"Error loading index: {e}")
+        new_index = None
+    
+    index_metadata = read_index_metadata()
+    model_name = index_metadata.get("model_name")
+    if new_index is not None and model_name is not None and model_name != CLIP_MODEL_NAME:
+        print(f"⚠️  Index was built with {model_name} but the server uses {CLIP_MODEL_NAME}. Please reindex.")
+    
+    embedding_index = new_index
+    index_status = "loaded" if new_index is not None else "missing"
+    if embedding_index is not None:
+        print(f"Loaded index into memory: {len(embedding_index)} images ({embedding_index.num_valid} valid)")
+
+def open_catalog(rows: int) -> Optional[ImageCatalog]:
+    """The catalog belonging to an index of `rows` images, or None if it is missing or out of date"""
+    try:
+        catalog = ImageCatalog.open(CATALOG_FILE)
+        if catalog is not None and len(catalog) != rows:
+            print("⚠️  Image catalog does not match the index, metadata filters are unavailable until it is rebuilt")
+            catalog.close()
+            return None
+        return catalog
+    except Exception as e:
+        print(f"Error opening {CATALOG_FILE}: {e}")
+        return None
+
+def open_keyword_index(rows: int) -> Optional[KeywordIndex]:
+    """The keyword index belonging to an index of `rows` images, or None if it is missing or out of date"""
+    try:
+        keywords = KeywordIndex.load(KEYWORD_INDEX_FILE)
+    except Exception as e:
+        print(f"Error loading {KEYWORD_INDEX_FILE}: {e}")
+        return None
+    if keywords is not None and keywords.n_rows != rows:
+        print("⚠️  Keyword index does not match the index, hybrid search falls back to vector search until it is rebuilt")
+        return None
+    return keywords
+
+def read_catalog_records(image_paths: List[str], manifest: dict, job: Optional[ReindexJob] = None) -> List[ImageRecord]:
+    """Read the header metadata and captions of images for the catalog, reported as the "cataloging" stage"""
+    if job is not None:
+        job.set_stage("cataloging", total=len(image_paths))
+    signatures = [manifest.get(img_path) for img_path in image_paths]
+    on_progress = job.advance if job is not None else None
+    return read_image_records(image_paths, signatures, num_workers=SCAN_NUM_WORKERS, on_progress=on_progress)
+
+def save_catalog(
+    image_paths: List[str],
+    records: List[ImageRecord],
+    kept_rows: Optional[np.ndarray] = None,
+    old_row_count: int = 0,
+):
+    """
+    Write the catalog and the keyword index for the index rows. With kept_rows (sorted old rows that stay),
+    the existing catalog is updated in place and records only cover the rows appended after the kept ones;
+    otherwise a new catalog is written from records for every row.
+    """
+    if kept_rows is None:
+        write_catalog(CATALOG_FILE, records)
+    else:
+        update_catalog(CATALOG_FILE, kept_rows, old_row_count, records)
+    
+    # The keyword index is updated the same way when it matches the old rows; otherwise it is built
+    # from the captions in the catalog
+    old_keywords = open_keyword_index(old_row_count) if kept_rows is not None else None
+    if old_keywords is not None:
+        new_paths = image_paths[len(kept_rows):]
+        documents = keyword_documents(new_paths, (record.caption for record in records), PHOTO_LIBRARY_PATH)
+        keywords = old_keywords.update(kept_rows, documents)
+    else:
+        catalog = ImageCatalog(CATALOG_FILE)
+        try:
+            captions = list(catalog.captions())
+        finally:
+            catalog.close()
+        keywords = KeywordIndex.build(keyword_documents(image_paths, captions, PHOTO_LIBRARY_PATH))
+    keywords.save(KEYWORD_INDEX_FILE)
+    print(f"Keyword index saved: {len(keywords)} tokens")
+
+def file_signature(image_path: str) -> dict:
+    """Size and modification time used to detect changed files"""
+    stat = os.stat(image_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def file_content_hash(image_path: str) -> str:
+    """SHA-1 of the file contents, used when size/mtime alone are not trusted"""
+    sha1 = hashlib.sha1()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def caption_changed(signature: dict, entry: Optional[dict]) -> bool:
+    """Whether the image's caption sidecars were added, edited or removed since its manifest entry"""
+    return entry is not None and entry.get("sidecar_mtime_ns") != signature.get("sidecar_mtime_ns")
+
+def is_unchanged(image_path: str, signature: dict, entry: Optional[dict]) -> bool:
+    """Check a file against its manifest entry, filling in the content hash if enabled"""
+    if entry is None:
+        # Index built before the manifest existed: trust the stored embedding
+        return True
+    if entry.get("size") == signature["size"] and entry.get("mtime_ns") == signature["mtime_ns"]:
+        if "sha1" in entry:
+            signature["sha1"] = entry["sha1"]
+        return True
+    if INDEX_CONTENT_HASH and "sha1" in entry:
+        # Touched or copied but identical content (e.g. restored from backup)
+        content_hash = file_content_hash(image_path)
+        signature["sha1"] = content_hash
+        return content_hash == entry["sha1"]
+    return False
+
+def read_index_metadata() -> dict:
+    """Contents of image_index.json, or {} if there is no index yet"""
+    if not os.path.exists(INDEX_FILE):
+        return {}
+    try:
+        with open(INDEX_FILE, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error reading {INDEX_FILE}: {e}")
+        return {}
+
+def index_mismatch(index_data: dict) -> Optional[str]:
+    """Why an on-disk index cannot be reused with the current configuration, or None if it can"""
+    # Embeddings from a different model live in a different vector space
+    model_name = index_data.get("model_name")
+    if model_name is not None and model_name != CLIP_MODEL_NAME:
+        return f"built with {model_name}, not {CLIP_MODEL_NAME}"
+    library_path = index_data.get("photo_library_path")
+    if library_path is not None and os.path.abspath(library_path) != os.path.abspath(PHOTO_LIBRARY_PATH):
+        return f"built for {library_path}, not {PHOTO_LIBRARY_PATH}"
+    return None
+
+def load_index_files():
+    """Read the on-disk index: (embeddings, paths, manifest), or (None, [], {}) if missing"""
+    if not os.path.exists(EMBEDDINGS_FILE) or not os.path.exists(IMAGE_PATHS_FILE):
+        return None, [], {}
+    
+    mismatch = index_mismatch(read_index_metadata())
+    if mismatch is not None:
+        print(f"Existing index was {mismatch}; rebuilding")
+        return None, [], {}
+    
+    try:
+        # Memory-mapped: only the rows we reuse are read from disk
+        embeddings = np.load(EMBEDDINGS_FILE, mmap_mode='r')
+        with open(IMAGE_PATHS_FILE, 'r') as f:
+            image_paths = json.load(f)
+        manifest = {}
+        if os.path.exists(IMAGE_MANIFEST_FILE):
+            with open(IMAGE_MANIFEST_FILE, 'r') as f:
+                manifest = json.load(f)
+    except Exception as e:
+        print(f"Error reading existing index, rebuilding: {e}")
+        return None, [], {}
+    
+    if len(embeddings) != len(image_paths):
+        print("Existing index is inconsistent (embeddings and paths count don't match), rebuilding")
+        return None, [], {}
+    
+    return embeddings, image_paths, manifest
+
+def save_json_atomic(path: str, data, **kwargs):
+    """Write JSON to a temp file and rename it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
+def write_embeddings(old_embeddings: Optional[np.ndarray], reused_rows: np.ndarray, new_batches: List[np.ndarray]) -> np.ndarray:
+    """
+    Write the reused rows of the old matrix followed by the newly encoded batches into a new embeddings
+    file, chunk by chunk, and return it memory-mapped. Neither matrix is ever held in RAM as a whole.
+    """
+    dim = old_embeddings.shape[1] if len(reused_rows) else new_batches[0].shape[1]
+    total = len(reused_rows) + sum(len(batch) for batch in new_batches)
+    # Written to a temp file and renamed, so a server that has the old file memory-mapped is unaffected
+    tmp_path = f"{EMBEDDINGS_FILE}.tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.dtype(EMBEDDINGS_DTYPE), shape=(total, dim))
+    position = 0
+    for start in range(0, len(reused_rows), SAVE_CHUNK_ROWS):
+        # Sorted row ids: the old file is read sequentially
+        rows = reused_rows[start:start + SAVE_CHUNK_ROWS]
+        out[position:position + len(rows)] = old_embeddings[rows]
+        position += len(rows)
+    for batch in new_batches:
+        out[position:position + len(batch)] = batch
+        position += len(batch)
+    out.flush()
+    del out
+    os.replace(tmp_path, EMBEDDINGS_FILE)
+    return np.load(EMBEDDINGS_FILE, mmap_mode='r')
+
+def save_index_files(embeddings_array: np.ndarray, image_paths: List[str], manifest: dict):
+    """Persist paths, manifest and index metadata for the embeddings already written"""
+    save_json_atomic(IMAGE_PATHS_FILE, image_paths)
+    save_json_atomic(IMAGE_MANIFEST_FILE, manifest)
+    
+    # Create index metadata
+    index_data = {
+        "total_images": len(image_paths),
+        "photo_library_path": PHOTO_LIBRARY_PATH,
+        "embedding_dim": int(embeddings_array.shape[1]) if embeddings_array.ndim == 2 else 0,
+        "embedding_dtype": str(embeddings_array.dtype),
+        "model_name": CLIP_MODEL_NAME
+    }
+    save_json_atomic(INDEX_FILE, index_data, indent=2)
+
+def build_ann_index(embeddings_array: np.ndarray, retrain: bool = False, kept_rows: Optional[np.ndarray] = None, old_row_count: int = 0):
+    """
+    Build (or refresh) the IVF index for large libraries, removing it for small ones. With kept_rows (sorted
+    old rows that stay, followed by new rows), the old lists are updated and only the new rows are assigned.
+    """
+    if len(embeddings_array) < ANN_MIN_IMAGES:
+        if os.path.exists(ANN_INDEX_FILE):
+            os.remove(ANN_INDEX_FILE)
+        return
+    
+    # Reuse the trained centroids after an incremental reindex
+    old_ann = None if retrain else IVFIndex.load(ANN_INDEX_FILE)
+    if old_ann is not None and old_ann.centroids.shape[1] != embeddings_array.shape[1]:
+        old_ann = None
+    if old_ann is not None and kept_rows is not None and old_ann.n_rows == old_row_count:
+        ann = old_ann.update(kept_rows, embeddings_array[len(kept_rows):])
+        ann.save(ANN_INDEX_FILE)
+        print(f"ANN index updated: {len(embeddings_array) - len(kept_rows)} rows assigned")
+        return
+    
+    print(f"Building ANN index for {len(embeddings_array)} images ({'reassigning' if old_ann else 'training'})...")
+    ann = IVFIndex.build(
+        embeddings_array,
+        n_lists=ANN_NLISTS or None,
+        centroids=old_ann.centroids if old_ann is not None else None,
+    )
+    ann.save(ANN_INDEX_FILE)
+    print(f"ANN index built: {ann.n_lists} lists")
+
+def build_compressed_codes(embeddings_array: np.ndarray, retrain: bool = False, kept_rows: Optional[np.ndarray] = None, old_row_count: int = 0):
+    """
+    Build the sq8/pq codes for the embedding store if compression is enabled. With kept_rows, the old codes
+    are kept and only the new rows are encoded.
+    """
+    if INDEX_COMPRESSION == "none":
+        if os.path.exists(COMPRESSED_CODES_FILE):
+            os.remove(COMPRESSED_CODES_FILE)
+        return
+    
+    # Like the ANN centroids, trained PQ codebooks are reused unless this is a full rebuild
+    previous = None if retrain else load_quantizer(COMPRESSED_CODES_FILE)
+    reusable = (
+        previous is not None and previous.kind == INDEX_COMPRESSION and previous.dim == embeddings_array.shape[1]
+        and (previous.kind != "pq" or previous.n_subspaces == PQ_SUBSPACES)
+    )
+    if reusable and kept_rows is not None and previous.n_rows == old_row_count:
+        quantizer = previous.update(kept_rows, embeddings_array[len(kept_rows):])
+        save_quantizer(quantizer, COMPRESSED_CODES_FILE)
+        print(f"Compressed codes updated: {len(embeddings_array) - len(kept_rows)} rows encoded")
+        return
+    
+    print(f"Building {INDEX_COMPRESSION} compressed codes for {len(embeddings_array)} images...")
+    quantizer = build_quantizer(INDEX_COMPRESSION, embeddings_array, n_subspaces=PQ_SUBSPACES, previous=previous)
+    save_quantizer(quantizer, COMPRESSED_CODES_FILE)
+    print(f"Compressed codes built: {quantizer.codes.nbytes / 1e6:.1f} MB")
+
+def index_images(force_reindex: bool = False, job: Optional[ReindexJob] = None):
+    """Index all images in the photo library, only encoding new or changed files"""
+    with indexing_lock:
+        _index_images(force_reindex, job)
+
+def _index_images(force_reindex: bool, job: Optional[ReindexJob]):
     print(f"Indexing images from: {PHOTO_LIBRARY_PATH}")
+    if job is not None:
+        job.set_stage("loading")
     
-    # If force reindex, clear old index files first
     if force_reindex:
-        print("Force reindex: Clearing old index files...")
-        if os.path.exists(INDEX_FILE):
-            os.remove(INDEX_FILE)
-        if os.path.exists(EMBEDDINGS_FILE):
-            os.remove(EMBEDDINGS_FILE)
-        if os.path.exists(IMAGE_PATHS_FILE):
-            os.remove(IMAGE_PATHS_FILE)
-    
-    # Check if index exists and is valid
-    if not force_reindex and os.path.exists(INDEX_FILE) and os.path.exists(EMBEDDINGS_FILE):
-        if check_new_images:
-            # Check if there are new images
-            current_images = set(get_image_files(PHOTO_LIBRARY_PATH))
-            with open(IMAGE_PATHS_FILE, 'r') as f:
-                indexed_paths = set(json.load(f))
+        print("Force reindex: ignoring existing index files...")
+        old_embeddings, old_paths, old_manifest = None, [], {}
+    else:
+        old_embeddings, old_paths, old_manifest = load_index_files()
+    old_rows = {path: row for row, path in enumerate(old_paths)}
+    
+    # Split the library into rows we can reuse and files that need encoding. The scan streams into the
+    # encoding pipeline, so new photos are being encoded while the rest of the tree is still being listed.
+    if job is not None:
+        # Files are encoded as the scan finds them; the total is only final once the scan is done
+        job.set_stage("scanning+encoding", total=0, total_growing=True)
+    reused_rows = []
+    reused_paths = []
+    # Unchanged images whose caption sidecar changed: their embeddings are reused, their metadata re-read
+    recaptioned_rows = []
+    recaptioned_paths = []
+    manifest = {}
+    counts = {"found": 0, "changed": 0, "to_encode": 0, "failed": 0}
+    
+    def classify() -> Iterator[str]:
+        # Only this shard's share when sharded
+        for scanned in scan_image_files(PHOTO_LIBRARY_PATH):
+            img_path = scanned.path
+            if not is_own_shard(img_path):
+                continue
+            counts["found"] += 1
+            signature = {"size": scanned.size, "mtime_ns": scanned.mtime_ns}
+            if scanned.sidecar_mtime_ns is not None:
+                signature["sidecar_mtime_ns"] = scanned.sidecar_mtime_ns
             
-            # Verify indexed paths still exist
-            valid_indexed_paths = {p for p in indexed_paths if os.path.exists(p)}
-            removed_images = indexed_paths - valid_indexed_paths
-            new_images = current_images - indexed_paths
+            row = old_rows.get(img_path)
+            entry = old_manifest.get(img_path)
+            failed_before = row is None and entry is not None and entry.get("failed", False)
+            try:
+                unchanged = (row is not None or failed_before) and is_unchanged(img_path, signature, entry)
+            except OSError:
+                # Hashing a file that vanished since it was listed; it must not abort the whole reindex
+                print(f"⚠️  Skipping non-existent file: {img_path}")
+                continue
+            if unchanged and failed_before:
+                # Could not be decoded last time and hasn't changed since: only retried once it changes
+                manifest[img_path] = {**signature, "failed": True}
+                counts["failed"] += 1
+                continue
+            if unchanged:
+                manifest[img_path] = signature
+                if caption_changed(signature, old_manifest.get(img_path)):
+                    recaptioned_rows.append(row)
+                    recaptioned_paths.append(img_path)
+                else:
+                    reused_rows.append(row)
+                    reused_paths.append(img_path)
+                continue
             
-            if new_images or removed_images:
-                print(f"Detected changes: {len(new_images)} new images, {len(removed_images)} removed")
-                print("Reindexing to update index...")
-                force_reindex = True
-            else:
-                print("Using existing index (no changes detected)")
-                return
-        else:
-            print("Using existing index")
-            return
+            if row is not None:
+                counts["changed"] += 1
+            if INDEX_CONTENT_HASH and "sha1" not in signature:
+                try:
+                    signature["sha1"] = file_content_hash(img_path)
+                except OSError:
+                    print(f"⚠️  Skipping non-existent file: {img_path}")
+                    continue
+            manifest[img_path] = signature
+            counts["to_encode"] += 1
+            if job is not None:
+                # The total grows while the scan is still discovering files
+                job.total += 1
+            yield img_path
+        if job is not None:
+            job.continue_stage("encoding")
     
-    # Get all image files
-    image_files = get_image_files(PHOTO_LIBRARY_PATH)
-    print(f"Found {len(image_files)} images")
+    embeddings, valid_paths = encode_images(classify(), manifest, job=job)
+    print(f"Found {counts['found']} images")
     
-    if len(image_files) == 0:
-        print("No images found!")
+    if counts["found"] == 0:
+        print("No images found! Keeping existing index.")
+        load_index()
         return
     
-    # Compute embeddings - only for files that actually exist
+    changed = counts["changed"]
+    removed = len(old_paths) - len(reused_rows) - len(recaptioned_rows) - changed
+    print(
+        f"Index changes: {counts['to_encode'] - changed} new, {changed} modified, {removed} removed, "
+        f"{len(recaptioned_rows)} captions changed, {len(reused_rows)} unchanged, "
+        f"{counts['failed']} skipped (unreadable and unchanged)"
+    )
+    
+    # Decided by what was actually encoded: files that failed to decode don't change the index rows
+    if old_embeddings is not None and not valid_paths and len(reused_rows) == len(old_paths):
+        print("Using existing index (no changes detected)")
+        if manifest != old_manifest or not os.path.exists(IMAGE_MANIFEST_FILE):
+            # Only the manifest changed (e.g. newly recorded decode failures)
+            save_json_atomic(IMAGE_MANIFEST_FILE, manifest)
+        # The scan just saw every indexed file, so none of them needs checking on disk again
+        index = embedding_index
+        if index is not None and index.catalog is not None and index.keywords is not None and index.paths == old_paths:
+            # Already loaded (e.g. at startup): keep it rather than loading and opening everything again
+            index.valid_mask = np.ones(len(old_paths), dtype=bool)
+            return
+        if index is None or index.catalog is None or index.keywords is None:
+            # Index built before the catalog and keyword index existed (or with an older catalog schema):
+            # the embedding rows are still in image_paths.json order
+            save_catalog(old_paths, read_catalog_records(old_paths, old_manifest, job=job))
+        load_index(valid_mask=np.ones(len(old_paths), dtype=bool))
+        return
+    
+    append_copied_rows(old_embeddings, recaptioned_rows, recaptioned_paths, embeddings, valid_paths)
+    save_and_swap_index(old_embeddings, reused_rows, reused_paths, embeddings, valid_paths, manifest, job=job, retrain=force_reindex)
+
+def append_copied_rows(
+    old_embeddings: Optional[np.ndarray],
+    rows: List[int],
+    paths: List[str],
+    embeddings: List[np.ndarray],
+    valid_paths: List[str],
+):
+    """
+    Add old rows to the newly encoded ones with their embeddings copied instead of re-encoded (images whose
+    caption sidecar changed), so their catalog record and keyword postings are rebuilt like a new row's
+    """
+    order = np.argsort(np.asarray(rows, dtype=np.int64), kind="stable")
+    rows = np.asarray(rows, dtype=np.int64)[order]
+    for start in range(0, len(rows), SAVE_CHUNK_ROWS):
+        embeddings.append(np.asarray(old_embeddings[rows[start:start + SAVE_CHUNK_ROWS]]))
+    valid_paths.extend(paths[i] for i in order)
+
+def _encode_and_save(
+    old_embeddings: Optional[np.ndarray],
+    reused_rows: List[int],
+    reused_paths: List[str],
+    to_encode: List[str],
+    manifest: dict,
+    job: Optional[ReindexJob] = None,
+    retrain: bool = False,
+    carry_validity: bool = False,
+    recaptioned_rows: Optional[List[int]] = None,
+    recaptioned_paths: Optional[List[str]] = None,
+):
+    """
+    Encode new/changed files, combine them with the reused rows (and the copied rows of recaptioned images),
+    persist everything and swap in the new index
+    """
+    if job is not None:
+        job.set_stage("encoding", total=len(to_encode))
+    embeddings, valid_paths = encode_images(to_encode, manifest, job=job)
+    append_copied_rows(old_embeddings, recaptioned_rows or [], recaptioned_paths or [], embeddings, valid_paths)
+    if old_embeddings is not None and not valid_paths and len(reused_rows) == len(old_embeddings):
+        # Everything failed to decode and no row was dropped: only the manifest records the failures
+        save_json_atomic(IMAGE_MANIFEST_FILE, manifest)
+        return
+    save_and_swap_index(
+        old_embeddings, reused_rows, reused_paths, embeddings, valid_paths, manifest,
+        job=job, retrain=retrain, carry_validity=carry_validity,
+    )
+
+def encode_images(to_encode: Iterable[str], manifest: dict, job: Optional[ReindexJob] = None):
+    """
+    Encode images in batches, decoding them in parallel worker processes; to_encode may be a generator
+    that is still scanning. Returns (list of embedding batches, encoded paths); failures are marked in the manifest.
+    """
     embeddings = []
     valid_paths = []
+    processed = 0
     
-    for i, img_path in enumerate(image_files):
-        # Verify file exists before processing
-        if not os.path.exists(img_path):
-            print(f"⚠️  Skipping non-existent file: {img_path}")
-            continue
-            
-        if i % 10 == 0:
-            print(f"Processing {i+1}/{len(image_files)}...")
-        
-        embedding = compute_image_embedding(img_path)
-        if embedding is not None:
-            embeddings.append(embedding)
-            valid_paths.append(img_path)
+    batches = encode_image_batches(
+        to_encode,
+        image_preprocess,
+        encode_image_tensor,
+        batch_size=INDEX_BATCH_SIZE,
+        num_workers=INDEX_NUM_WORKERS,
+    )
+    print(f"Encoding new and changed images with batch size {INDEX_BATCH_SIZE} and {INDEX_NUM_WORKERS} decode workers")
+    try:
+        for batch_paths, batch_embeddings, failed in batches:
+            if batch_paths:
+                embeddings.append(batch_embeddings)
+                valid_paths.extend(batch_paths)
+            for img_path in failed:
+                # Recorded by size/mtime, so the file is only retried once it changes
+                if img_path in manifest:
+                    manifest[img_path]["failed"] = True
+            processed += len(batch_paths) + len(failed)
+            INDEXED_IMAGES.inc(len(batch_paths))
+            INDEX_FAILURES.inc(len(failed))
+            print(f"Processing {processed}/{job.total if job is not None else '?'}...")
+            if job is not None:
+                # Raises ReindexCancelled; nothing is saved and the current index stays in use
+                job.advance(len(batch_paths) + len(failed))
+    finally:
+        # Shut down the decode workers even if the job was cancelled mid-way
+        batches.close()
+    
+    return embeddings, valid_paths
+
+def save_and_swap_index(
+    old_embeddings: Optional[np.ndarray],
+    reused_rows: List[int],
+    reused_paths: List[str],
+    embeddings: List[np.ndarray],
+    valid_paths: List[str],
+    manifest: dict,
+    job: Optional[ReindexJob] = None,
+    retrain: bool = False,
+    carry_validity: bool = False,
+):
+    """
+    Combine reused rows with the newly encoded ones, persist everything and swap in the new index.
+    With carry_validity, the reused rows keep the loaded index's validity instead of being checked on disk
+    again (used by the watcher, whose unchanged files were not looked at).
+    """
+    encoded_count = len(valid_paths)
+    # Keep reused rows in their old order, so they are copied from the memory-mapped file sequentially
+    order = np.argsort(np.asarray(reused_rows, dtype=np.int64), kind="stable")
+    reused_rows = np.asarray(reused_rows, dtype=np.int64)[order]
+    valid_paths = [reused_paths[i] for i in order] + valid_paths
     
-    if len(embeddings) == 0:
+    if len(valid_paths) == 0:
         print("No valid embeddings generated!")
+        load_index()
         return
     
-    # Save embeddings and paths
-    embeddings_array = np.array(embeddings)
-    np.save(EMBEDDINGS_FILE, embeddings_array)
+    # The existing catalog is updated in place, unless this is a full reindex or it doesn't match the old
+    # index. Headers are read before anything is written, while the job can still be cancelled.
+    old_row_count = len(old_embeddings) if old_embeddings is not None else 0
+    old_catalog = open_catalog(old_row_count) if old_row_count and not retrain else None
+    if old_catalog is not None:
+        old_catalog.close()
+        records = read_catalog_records(valid_paths[len(reused_rows):], manifest, job=job)
+    else:
+        records = read_catalog_records(valid_paths, manifest, job=job)
     
-    with open(IMAGE_PATHS_FILE, 'w') as f:
-        json.dump(valid_paths, f)
+    # Save embeddings, paths, manifest and catalog
+    if job is not None:
+        job.set_stage("saving")
+    embeddings_array = write_embeddings(old_embeddings, reused_rows, embeddings)
+    save_index_files(embeddings_array, valid_paths, manifest)
+    if old_catalog is not None:
+        save_catalog(valid_paths, records, kept_rows=reused_rows, old_row_count=old_row_count)
+    else:
+        save_catalog(valid_paths, records)
+    # ANN lists and compressed codes of the reused rows are carried over; only new rows are assigned/encoded
+    kept_rows = reused_rows if old_row_count and not retrain else None
+    build_ann_index(embeddings_array, retrain=retrain, kept_rows=kept_rows, old_row_count=old_row_count)
+    build_compressed_codes(embeddings_array, retrain=retrain, kept_rows=kept_rows, old_row_count=old_row_count)
     
-    # Create index metadata
-    index_data = {
-        "total_images": len(valid_paths),
-        "photo_library_path": PHOTO_LIBRARY_PATH,
-        "embedding_dim": embeddings_array.shape[1]
+    # Reused rows were either just seen by the library scan or are carried over from the loaded index;
+    # new rows were just read. Either way the files don't need to be checked on disk again.
+    previous = embedding_index
+    if carry_validity and previous is not None and len(previous) == old_row_count:
+        valid_mask = np.concatenate([previous.valid_mask[reused_rows], np.ones(encoded_count, dtype=bool)])
+    else:
+        valid_mask = np.ones(len(valid_paths), dtype=bool)
+    
+    print(f"Indexed {len(valid_paths)} images successfully! ({encoded_count} encoded)")
+    load_index(valid_mask=valid_mask)
+    
+    if THUMBNAILS_ON_INDEX:
+        new_paths = valid_paths[len(valid_paths) - encoded_count:]
+        if job is not None:
+            job.set_stage("thumbnails", total=len(new_paths))
+        print(f"Generating thumbnails for {len(new_paths)} images...")
+        # The new index is already in use; cancelling the job only skips the remaining thumbnails
+        thumbnail_cache.pregenerate(new_paths, THUMBNAIL_INDEX_SIZE, on_progress=job.advance if job is not None else None)
+
+def apply_library_changes(changed_paths: Set[str], deleted_paths: Set[str]):
+    """Apply changed and deleted files (images or their caption sidecars) to the index without rescanning the whole library"""
+    with indexing_lock:
+        old_embeddings, old_paths, manifest = load_index_files()
+        if old_embeddings is None:
+            # No usable index (never built, inconsistent or from another model): applying only the
+            # changed files would write an index of just those, so index the whole library instead
+            print("Library changed but there is no usable index, indexing the whole library")
+            _index_images(False, None)
+            return
+        
+        # An added, edited or deleted sidecar changes its image's caption
+        sidecars = {path for path in changed_paths | deleted_paths if is_sidecar_file(path)}
+        captioned = {img_path for sidecar in sidecars for img_path in images_of_sidecar(sidecar) if is_own_shard(img_path)}
+        changed_paths = (changed_paths - sidecars) | captioned
+        deleted_paths = deleted_paths - sidecars
+        
+        old_rows = {img_path: row for row, img_path in enumerate(old_paths)}
+        to_encode = []
+        recaptioned = []
+        for img_path in sorted(changed_paths):
+            try:
+                signature = file_signature(img_path)
+                sidecar_mtime = sidecar_mtime_ns(img_path)
+                if sidecar_mtime is not None:
+                    signature["sidecar_mtime_ns"] = sidecar_mtime
+                entry = manifest.get(img_path)
+                if img_path in old_rows and entry is not None and is_unchanged(img_path, signature, entry):
+                    if caption_changed(signature, entry):
+                        manifest[img_path] = signature
+                        recaptioned.append(img_path)
+                    continue
+                if INDEX_CONTENT_HASH and "sha1" not in signature:
+                    signature["sha1"] = file_content_hash(img_path)
+            except OSError:
+                deleted_paths = deleted_paths | {img_path}
+                continue
+            manifest[img_path] = signature
+            to_encode.append(img_path)
+        
+        removed = [img_path for img_path in deleted_paths if img_path in old_rows]
+        for img_path in deleted_paths:
+            manifest.pop(img_path, None)
+        dropped = set(to_encode) | set(removed) | set(recaptioned)
+        reused_rows = [row for row, img_path in enumerate(old_paths) if img_path not in dropped]
+        if not to_encode and not removed and not recaptioned:
+            return
+        
+        print(f"Library changed: {len(to_encode)} new or modified, {len(removed)} removed, {len(recaptioned)} captions changed")
+        _encode_and_save(
+            old_embeddings,
+            reused_rows,
+            [old_paths[row] for row in reused_rows],
+            to_encode,
+            manifest,
+            carry_validity=True,
+            recaptioned_rows=[old_rows[img_path] for img_path in recaptioned],
+            recaptioned_paths=recaptioned,
+        )
+
+def library_snapshot() -> dict:
+    """(size, mtime, sidecar mtime) of every image in the library, for the polling watcher"""
+    return {
+        scanned.path: (scanned.size, scanned.mtime_ns, scanned.sidecar_mtime_ns)
+        for scanned in scan_image_files(PHOTO_LIBRARY_PATH)
+        if is_own_shard(scanned.path)
     }
+
+def start_library_watcher():
+    global library_watcher
+    
+    library_watcher = LibraryWatcher(
+        PHOTO_LIBRARY_PATH,
+        # Sidecars are mapped to their images (which may belong to this shard) when the batch is applied
+        is_watched=lambda path: (is_image_file(path) and is_own_shard(path)) or is_sidecar_file(path),
+        on_changes=apply_library_changes,
+        on_rescan=index_images,
+        snapshot=library_snapshot,
+        debounce_seconds=WATCH_DEBOUNCE_SECONDS,
+        min_interval_seconds=WATCH_MIN_INTERVAL_SECONDS,
+        poll_interval=WATCH_POLL_INTERVAL,
+        force_polling=WATCH_FORCE_POLLING,
+    )
+    library_watcher.start()
+
+def start_reindex_job(full: bool = False):
+    """Start a background reindex job unless one is running; returns (started, job)"""
+    global reindex_job
+    
+    with reindex_job_lock:
+        if reindex_job is not None and reindex_job.is_active:
+            return False, reindex_job
+        
+        # Searches keep using the current index until the job finishes and swaps in the new one
+        reindex_job = ReindexJob(full=full)
+        reindex_job.start(run_reindex_job)
+        return True, reindex_job
+
+def load_startup_index():
+    """
+    Load the existing index if it matches the model and library. Runs in the warm-up thread: checking
+    every indexed file on disk and opening the catalog and keyword index would block the event loop.
+    """
+    global index_status
     
-    with open(INDEX_FILE, 'w') as f:
-        json.dump(index_data, f, indent=2)
+    index_status = "loading"
+    mismatch = index_mismatch(read_index_metadata())
+    if mismatch is not None:
+        index_status = "mismatched"
+        print(f"Existing index was {mismatch}; it will be rebuilt once the model is loaded")
+        return
+    load_index()
+
+def warm_up():
+    """Background part of startup: load the existing index and the model, then bring the index up to date"""
+    global model_status
     
-    print(f"Indexed {len(valid_paths)} images successfully!")
+    # The index comes first, so /image, /stats and search by indexed photo work while CLIP is still loading
+    load_startup_index()
+    model_status = "loading"
+    try:
+        initialize_models()
+    except Exception as e:
+        model_status = "failed"
+        print(f"Error loading CLIP model: {e}")
+        return
+    model_status = "ready"
+    
+    # Incremental reindex: only new or changed photos are encoded, deleted ones are dropped
+    print("Updating index with any new or changed photos...")
+    start_reindex_job(full=False)
+    if WATCH_LIBRARY and os.path.isdir(PHOTO_LIBRARY_PATH):
+        start_library_watcher()
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize models and index on startup"""
-    initialize_models()
-    # Force reindex on startup to pick up new Flickr30k photos
-    # This ensures we always use the latest photos and ignore old ones
-    print("Starting up: Reindexing photos to ensure latest dataset is indexed...")
-    index_images(force_reindex=True)
+    """Start serving right away; the index and the model load and the index catches up in the background"""
+    global query_batcher
+    if shard_client is not None:
+        # Coordinator: no model or index of its own, only fans queries out to the shards
+        print(f"Starting up as coordinator for {len(shard_client.urls)} shards: {', '.join(shard_client.urls)}")
+        return
+    
+    if SHARD_COUNT > 1:
+        print(f"Starting up as shard {SHARD_ID} of {SHARD_COUNT} (by {SHARD_BY})")
+    
+    if QUERY_BATCHING:
+        query_batcher = QueryBatcher(run_search_batch, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS)
+        query_batcher.start()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if query_batcher is not None:
+        await query_batcher.stop()
+    if library_watcher is not None:
+        library_watcher.stop()
 
 @app.get("/")
 async def root():
@@ -193,125 +1111,531 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
-@app.post("/search", response_model=List[SearchResult])
-async def search_images(request: SearchRequest):
-    """Search for images matching the query"""
-    if clip_model is None:
-        raise HTTPException(status_code=500, detail="Model not initialized")
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the model is loaded and the startup index is usable, 503 before that"""
+    if shard_client is not None:
+        shard_status = await forward_to_shards("GET", "/ready")
+        is_ready = all(shard["response"] is not None and shard["response"].get("ready") for shard in shard_status["shards"])
+        return JSONResponse({"ready": is_ready, **shard_status}, status_code=200 if is_ready else 503)
     
-    # Load embeddings and paths
-    if not os.path.exists(EMBEDDINGS_FILE) or not os.path.exists(IMAGE_PATHS_FILE):
+    job = reindex_job
+    index = embedding_index
+    # With an empty library there is no index to wait for, only the first indexing pass
+    is_ready = model_status == "ready" and (index is not None or (job is not None and not job.is_active))
+    return JSONResponse(
+        {
+            "ready": is_ready,
+            "model": model_status,
+            "index": index_status,
+            "index_loaded": index is not None,
+            "indexed_images": index.num_valid if index is not None else 0,
+            "reindex": job.to_dict() if job is not None else None,
+        },
+        status_code=200 if is_ready else 503,
+    )
+
+def process_resident_bytes() -> Optional[int]:
+    """Resident memory of this process (Linux), including the touched pages of a memory-mapped index"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def cache_hit_ratio(stats: dict) -> Optional[float]:
+    lookups = stats["hits"] + stats["misses"]
+    return stats["hits"] / lookups if lookups else None
+
+def collect_metrics():
+    """Gauges computed when /metrics is scraped, so the search path itself pays nothing for them"""
+    index = embedding_index
+    job = reindex_job
+    job_status = job.to_dict() if job is not None else None
+    text_stats = text_embedding_cache.stats()
+    thumbnail_stats = thumbnail_cache.stats()
+    
+    yield "photo_search_model_ready", "gauge", "1 once the CLIP model is loaded", [({}, 1.0 if model_status == "ready" else 0.0)]
+    yield "photo_search_index_images", "gauge", "Indexed images whose files still exist", [({}, index.num_valid if index is not None else 0)]
+    yield "photo_search_index_rows", "gauge", "Rows in the embedding matrix", [({}, len(index) if index is not None else 0)]
+    yield "photo_search_index_bytes", "gauge", "Memory footprint of the search index by part", [
+        ({"part": "embeddings"}, index.nbytes if index is not None else 0),
+        ({"part": "codes"}, int(index.quantizer.codes.nbytes) if index is not None and index.quantizer is not None else 0),
+        ({"part": "ann"}, int(index.ann.list_ids.nbytes + index.ann.centroids.nbytes) if index is not None and index.ann is not None else 0),
+    ]
+    yield "photo_search_process_resident_bytes", "gauge", "Resident memory of the backend process", [({}, process_resident_bytes())]
+    yield "photo_search_cache_hit_ratio", "gauge", "Cache hit ratio since startup", [
+        ({"cache": "text_embeddings"}, cache_hit_ratio(text_stats)),
+        ({"cache": "thumbnails"}, cache_hit_ratio(thumbnail_stats)),
+    ]
+    yield "photo_search_cache_lookups_total", "counter", "Cache lookups by result", [
+        ({"cache": "text_embeddings", "result": "hit"}, text_stats["hits"]),
+        ({"cache": "text_embeddings", "result": "miss"}, text_stats["misses"]),
+        ({"cache": "thumbnails", "result": "hit"}, thumbnail_stats["hits"]),
+        ({"cache": "thumbnails", "result": "miss"}, thumbnail_stats["misses"]),
+    ]
+    yield "photo_search_query_queue_depth", "gauge", "Search queries waiting for the micro-batcher", [
+        ({}, query_batcher.queue_depth if query_batcher is not None else 0)
+    ]
+    yield "photo_search_reindex_active", "gauge", "1 while a reindex job is running", [
+        ({}, 1.0 if job is not None and job.is_active else 0.0)
+    ]
+    yield "photo_search_reindex_pending_images", "gauge", "Images the running reindex stage still has to process", [
+        ({}, max(job_status["total"] - job_status["processed"], 0) if job is not None and job.is_active else 0)
+    ]
+    yield "photo_search_reindex_images_per_second", "gauge", "Encoding throughput of the latest reindex job", [
+        ({}, job_status["encode_rate"] if job_status is not None else None)
+    ]
+
+REGISTRY.add_collector(collect_metrics)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text-format metrics"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def get_search_index(require_model: bool = True) -> EmbeddingIndex:
+    """Current in-memory index, or an HTTP error if searching is not possible yet"""
+    # model_status only becomes "ready" once the backend is verified and image_preprocess is set;
+    # clip_encoder is assigned before that
+    if require_model and model_status != "ready":
+        if model_status == "failed":
+            raise HTTPException(status_code=500, detail="Model failed to load")
+        raise HTTPException(status_code=503, detail="Model is still loading", headers={"Retry-After": "5"})
+    
+    index = embedding_index
+    if index is None and index_status in ("pending", "loading"):
+        raise HTTPException(status_code=503, detail="Index is still loading", headers={"Retry-After": "5"})
+    if index is None:
         raise HTTPException(status_code=404, detail="Image index not found. Please index images first.")
     
-    embeddings = np.load(EMBEDDINGS_FILE)
-    with open(IMAGE_PATHS_FILE, 'r') as f:
-        image_paths = json.load(f)
+    if index.num_valid == 0:
+        raise HTTPException(status_code=404, detail="No valid images found in index. Please reindex.")
     
-    # Verify that embeddings and paths match
-    if len(embeddings) != len(image_paths):
-        raise HTTPException(status_code=500, detail="Index mismatch: embeddings and paths count don't match. Please reindex.")
+    return index
+
+def resolve_nprobe(request: SearchRequest) -> int:
+    return request.nprobe if request.nprobe is not None else ANN_NPROBE
+
+def filter_rows(index: EmbeddingIndex, request) -> Optional[np.ndarray]:
+    """Catalog rows matching the request's metadata filters, or None if it has none"""
+    if request.taken_after is None and request.taken_before is None and request.folder is None and request.camera is None:
+        return None
+    if index.catalog is None:
+        raise HTTPException(status_code=503, detail="The image catalog is not built yet; filters work after the next reindex", headers={"Retry-After": "30"})
     
-    # Filter out non-existent files and their corresponding embeddings
-    valid_indices = []
-    valid_embeddings = []
-    valid_paths = []
+    folder = request.folder
+    if folder is not None and not os.path.isabs(folder):
+        folder = os.path.join(PHOTO_LIBRARY_PATH, folder)
+    with timed("prefilter"):
+        return index.catalog.filter_rows(
+            taken_after=request.taken_after,
+            taken_before=request.taken_before,
+            folder=os.path.normpath(folder) if folder is not None else None,
+            camera=request.camera,
+        )
+
+def keyword_boost(index: EmbeddingIndex, request: SearchRequest) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Weighted keyword scores (rows, values) of a hybrid query, or None for vector queries and no matches"""
+    if request.mode != "hybrid" or index.keywords is None:
+        return None
+    weight = request.keyword_weight if request.keyword_weight is not None else HYBRID_KEYWORD_WEIGHT
+    with timed("keyword_match"):
+        matches = index.keywords.score(request.query, max_rows=HYBRID_MAX_CANDIDATES, max_postings=HYBRID_MAX_POSTINGS)
+    if matches is None or weight == 0:
+        return None
+    rows, scores = matches
+    return rows, scores * np.float32(weight)
+
+def to_search_results(index: EmbeddingIndex, top_indices: np.ndarray, top_scores: np.ndarray) -> List[SearchResult]:
+    with timed("result_build"):
+        return [
+            SearchResult(path=index.paths[idx], score=float(score))
+            for idx, score in zip(top_indices, top_scores)
+        ]
+
+def vector_search(
+    index: EmbeddingIndex,
+    query_embedding: np.ndarray,
+    limit: int,
+    threshold: Optional[float],
+    nprobe: Optional[int],
+    exact: bool,
+    exclude_row: Optional[int] = None,
+    rows: Optional[np.ndarray] = None,
+) -> List[SearchResult]:
+    """Rank the index (or only `rows` of it) against a query embedding, optionally leaving one row out"""
+    # Ask for one extra result so the excluded row can be dropped
+    top_indices, top_scores = index.search(
+        query_embedding,
+        limit + (1 if exclude_row is not None else 0),
+        threshold=threshold,
+        nprobe=nprobe if nprobe is not None else ANN_NPROBE,
+        exact=exact,
+        rows=rows,
+    )
+    if exclude_row is not None:
+        keep = top_indices != exclude_row
+        top_indices, top_scores = top_indices[keep][:limit], top_scores[keep][:limit]
     
-    for idx, img_path in enumerate(image_paths):
-        if os.path.exists(img_path):
-            valid_indices.append(idx)
-            valid_embeddings.append(embeddings[idx])
-            valid_paths.append(img_path)
+    return to_search_results(index, top_indices, top_scores)
+
+def run_search_batch(search_requests: List[SearchRequest]) -> List[Union[List[SearchResult], HTTPException]]:
+    """
+    Answer many queries in one pass: one text-encoder batch and one matrix-matrix product. A query that
+    cannot be answered gets its HTTPException in place of results, so it doesn't fail the other queries
+    of a shared micro-batch.
+    """
+    index = get_search_index()
+    answers: List[Union[List[SearchResult], HTTPException, None]] = [None] * len(search_requests)
+    # Filtered queries only score the catalog rows that match
+    row_subsets = {}
+    for i, request in enumerate(search_requests):
+        try:
+            row_subsets[i] = filter_rows(index, request)
+        except HTTPException as e:
+            answers[i] = e
+    pending = list(row_subsets)
+    if not pending:
+        return answers
+    requests = [search_requests[i] for i in pending]
+    # Hybrid queries: postings lookups only, fused into the same scoring pass as the CLIP similarities
+    boosts = [keyword_boost(index, r) for r in requests]
     
-    if len(valid_embeddings) == 0:
-        raise HTTPException(status_code=404, detail="No valid images found in index. Please reindex.")
+    # Encode query texts (cached)
+    query_embeddings = get_text_embeddings([r.query for r in requests])
     
-    if len(valid_embeddings) < len(embeddings):
-        print(f"⚠️  Warning: {len(embeddings) - len(valid_embeddings)} indexed images no longer exist. Consider reindexing.")
-        # Update embeddings array
-        valid_embeddings = np.array(valid_embeddings)
-    
-    # Encode query text
-    with torch.no_grad():
-        text_tokens = clip.tokenize([request.query]).to(device)
-        text_features = clip_model.encode_text(text_tokens)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-        query_embedding = text_features.cpu().numpy().flatten()
-    
-    # Compute similarity scores
-    similarities = np.dot(valid_embeddings, query_embedding)
-    
-    # Get top results
-    top_indices = np.argsort(similarities)[::-1][:request.limit]
-    
-    # Filter by threshold if enabled
-    if request.use_threshold:
-        filtered_indices = [idx for idx in top_indices if similarities[idx] >= request.threshold]
-        if len(filtered_indices) == 0:
-            # If no results meet threshold, return top result anyway
-            filtered_indices = top_indices[:1] if len(top_indices) > 0 else []
-        top_indices = filtered_indices
-    
-    results = [
-        SearchResult(path=valid_paths[idx], score=float(similarities[idx]))
-        for idx in top_indices
-    ]
+    # Get top results (ANN when available, exact brute force otherwise), filtered by threshold if enabled
+    ranked = index.search_batch(
+        query_embeddings,
+        limits=[r.limit for r in requests],
+        thresholds=[r.threshold if r.use_threshold else None for r in requests],
+        nprobes=[resolve_nprobe(r) for r in requests],
+        exacts=[r.exact for r in requests],
+        row_subsets=[row_subsets[i] for i in pending],
+        boosts=boosts,
+    )
+    
+    for i, (top_indices, top_scores) in zip(pending, ranked):
+        answers[i] = to_search_results(index, top_indices, top_scores)
+    return answers
+
+def raise_failed(answers: list) -> list:
+    """The answers of run_search_batch, raising the first query's HTTPException if any query failed"""
+    for answer in answers:
+        if isinstance(answer, HTTPException):
+            raise answer
+    return answers
+
+def with_timings(results, include: bool, response: Optional[Response] = None) -> JSONResponse:
+    """
+    Search results rendered as JSON, with include=True (?timings=true) wrapped as {"results", "timings_ms"}
+    with the same per-stage timings as the Server-Timing header. Rendering here, rather than leaving it to
+    FastAPI after the handler returns, lets the "serialization" stage time the actual JSON encoding.
+    """
+    headers = {name: value for name, value in response.headers.items() if name.startswith("x-")} if response is not None else None
+    with timed("serialization"):
+        content = jsonable_encoder(results)
+        if include:
+            content = {"results": content, "timings_ms": current_stage_timings()}
+        return JSONResponse(content, headers=headers)
+
+def set_shard_header(response: Response, answered: int):
+    response.headers["X-Shards-Answered"] = f"{answered}/{len(shard_client.urls)}"
+
+@app.post("/search", response_model=List[SearchResult])
+async def search_images(request: SearchRequest, response: Response, timings: bool = False):
+    """Search for images matching the query"""
+    if shard_client is not None:
+        shard_results = await run_in_threadpool(shard_client.fan_out, "POST", "/search", json=jsonable_encoder(request))
+        results, answered = merge_top_k(shard_results, request.limit, request.threshold if request.use_threshold else None)
+        set_shard_header(response, answered)
+        return with_timings(results, timings, response)
+    
+    get_search_index()
+    if query_batcher is None:
+        results = raise_failed(await run_in_threadpool(run_search_batch, [request]))[0]
+    else:
+        # Concurrent queries are batched together and encoded and scored off the event loop
+        results = await query_batcher.submit(request)
+    return with_timings(results, timings)
+
+@app.post("/search/batch", response_model=List[List[SearchResult]])
+async def search_images_batch(search_requests: List[SearchRequest], response: Response, timings: bool = False):
+    """Answer many queries in one pass: one text-encoder batch and one matrix-matrix product"""
+    if shard_client is not None:
+        shard_results = await run_in_threadpool(
+            shard_client.fan_out, "POST", "/search/batch", json=jsonable_encoder(search_requests)
+        )
+        merged = []
+        answered = 0
+        for i, request in enumerate(search_requests):
+            results, answered = merge_top_k(
+                [shard[i] if shard is not None else None for shard in shard_results],
+                request.limit,
+                request.threshold if request.use_threshold else None,
+            )
+            merged.append(results)
+        set_shard_header(response, answered)
+        return with_timings(merged, timings, response)
+    
+    if not search_requests:
+        get_search_index()
+        return with_timings([], timings)
+    
+    return with_timings(raise_failed(await run_in_threadpool(run_search_batch, search_requests)), timings)
+
+@app.post("/search/vector", response_model=List[SearchResult])
+def search_by_vector(request: VectorSearchRequest, timings: bool = False):
+    """Search with a precomputed query embedding (used by the coordinator to fan out similarity queries)"""
+    index = get_search_index(require_model=False)
+    if len(request.embedding) != index.dim:
+        raise HTTPException(status_code=400, detail=f"Embedding must have {index.dim} dimensions")
+    
+    exclude_row = index.row_for_path(request.exclude_path) if request.exclude_path else None
+    results = vector_search(
+        index,
+        np.asarray(request.embedding, dtype=np.float32),
+        request.limit,
+        request.threshold if request.use_threshold else None,
+        request.nprobe,
+        request.exact,
+        exclude_row=exclude_row,
+        rows=filter_rows(index, request),
+    )
+    return with_timings(results, timings)
+
+@app.get("/embedding")
+def get_image_embedding(path: str):
+    """Stored embedding of an indexed image"""
+    index = get_search_index(require_model=False)
+    decoded_path = urllib.parse.unquote(path)
+    row = index.row_for_path(decoded_path)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Image is not indexed")
+    return {"path": decoded_path, "embedding": index.vector(row).tolist()}
+
+@app.get("/cameras")
+async def list_cameras():
+    """Cameras found in the EXIF data of indexed images, with image counts (values for the camera filter)"""
+    if shard_client is not None:
+        counts = {}
+        for shard in await run_in_threadpool(shard_client.fan_out, "GET", "/cameras"):
+            for entry in shard or []:
+                counts[entry["camera"]] = counts.get(entry["camera"], 0) + entry["images"]
+        return [{"camera": camera, "images": images} for camera, images in sorted(counts.items(), key=lambda item: -item[1])]
+    
+    index = embedding_index
+    if index is None or index.catalog is None:
+        return []
+    return await run_in_threadpool(index.catalog.cameras)
+
+def coordinator_search_similar(path, file, limit, threshold, use_threshold, nprobe, exact, response: Response):
+    """Similarity search across shards: fetch the stored vector from its shard, then fan out a vector search"""
+    fields = {"limit": limit, "threshold": threshold, "use_threshold": use_threshold, "nprobe": nprobe, "exact": exact}
+    if path is not None:
+        decoded_path = urllib.parse.unquote(path)
+        found = [result for result in shard_client.fan_out("GET", "/embedding", params={"path": decoded_path}) if result]
+        if not found:
+            raise HTTPException(status_code=404, detail="Image is not indexed on any shard")
+        shard_results = shard_client.fan_out(
+            "POST", "/search/vector",
+            json={"embedding": found[0]["embedding"], "exclude_path": decoded_path, **fields}
+        )
+    else:
+        # Uploaded image: every shard encodes it (shards have the model, the coordinator does not)
+        content = file.file.read()
+        shard_results = shard_client.fan_out(
+            "POST", "/search/similar",
+            data={key: value for key, value in fields.items() if value is not None},
+            files={"file": (file.filename or "upload", content, file.content_type or "application/octet-stream")}
+        )
     
+    results, answered = merge_top_k(shard_results, limit, threshold if use_threshold else None)
+    set_shard_header(response, answered)
     return results
 
+@app.post("/search/similar", response_model=List[SearchResult])
+def search_similar_images(
+    response: Response,
+    path: Optional[str] = Form(None),
+    file: Optional[UploadFile] = File(None),
+    limit: int = Form(20),
+    threshold: float = Form(0.0),
+    use_threshold: bool = Form(False),
+    nprobe: Optional[int] = Form(None),
+    exact: bool = Form(False),
+    timings: bool = False,
+):
+    """
+    Find photos similar to an indexed photo (by path: a row lookup, no model call)
+    or to an uploaded image (one encode_image call)
+    """
+    if (path is None) == (file is None):
+        raise HTTPException(status_code=400, detail="Provide either an indexed image path or an uploaded file")
+    
+    if shard_client is not None:
+        results = coordinator_search_similar(path, file, limit, threshold, use_threshold, nprobe, exact, response)
+        return with_timings(results, timings, response)
+    
+    exclude_row = None
+    if path is not None:
+        index = get_search_index(require_model=False)
+        decoded_path = urllib.parse.unquote(path)
+        exclude_row = index.row_for_path(decoded_path)
+        if exclude_row is not None:
+            query_embedding = index.vector(exclude_row)
+        else:
+            # Not indexed (yet): encode it like an upload, if it is inside the library
+            index = get_search_index()
+            query_embedding = compute_image_embedding(str(resolve_image_path(decoded_path)))
+            if query_embedding is None:
+                raise HTTPException(status_code=400, detail="Could not read image")
+    else:
+        index = get_search_index()
+        try:
+            image_tensor = load_image_tensor(io.BytesIO(file.file.read())).unsqueeze(0)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Could not read uploaded image: {e}")
+        query_embedding = encode_image_tensor(image_tensor)[0]
+    
+    results = vector_search(
+        index,
+        query_embedding,
+        limit,
+        threshold if use_threshold else None,
+        nprobe,
+        exact,
+        exclude_row=exclude_row,
+    )
+    return with_timings(results, timings)
+
+def run_reindex_job(job: ReindexJob):
+    """Body of a background reindex job"""
+    index_images(force_reindex=job.full, job=job)
+
+def get_reindex_job(job_id: Optional[str]) -> ReindexJob:
+    """Look up the latest reindex job, optionally checking its id"""
+    job = reindex_job
+    if job is None or (job_id is not None and job.id != job_id):
+        raise HTTPException(status_code=404, detail="Reindex job not found")
+    return job
+
+async def forward_to_shards(method: str, endpoint: str, **kwargs) -> dict:
+    """Coordinator: send a request to every shard and list their answers (None for shards that did not answer)"""
+    shard_results = await run_in_threadpool(shard_client.fan_out, method, endpoint, **kwargs)
+    return {"shards": [{"url": url, "response": result} for url, result in zip(shard_client.urls, shard_results)]}
+
 @app.post("/reindex")
-async def reindex_images():
-    """Force reindex all images"""
-    index_images(force_reindex=True)
-    return {"message": "Reindexing completed", "status": "success"}
+async def reindex_images(full: bool = False):
+    """Start reindexing new or changed images (or everything with full=true) in the background"""
+    if shard_client is not None:
+        return await forward_to_shards("POST", "/reindex", params={"full": full})
+    
+    if model_status != "ready":
+        raise HTTPException(status_code=503, detail="Model is still loading", headers={"Retry-After": "5"})
+    
+    started, job = start_reindex_job(full)
+    return {"message": "Reindexing started" if started else "Reindexing already in progress", **job.to_dict()}
+
+@app.get("/reindex/status")
+async def reindex_status(job_id: Optional[str] = None):
+    """Progress of the latest (or given) reindex job"""
+    if shard_client is not None:
+        return await forward_to_shards("GET", "/reindex/status")
+    return get_reindex_job(job_id).to_dict()
+
+@app.post("/reindex/cancel")
+async def cancel_reindex(job_id: Optional[str] = None):
+    """Cancel the running reindex job; the current index stays in use"""
+    if shard_client is not None:
+        return await forward_to_shards("POST", "/reindex/cancel")
+    job = get_reindex_job(job_id)
+    if job.is_active:
+        job.cancel()
+    return {"message": "Cancellation requested" if job.is_active else f"Job already {job.status}", **job.to_dict()}
 
 @app.get("/stats")
 async def get_stats():
     """Get indexing statistics"""
-    if not os.path.exists(INDEX_FILE):
-        return {"indexed": False, "total_images": 0}
+    if shard_client is not None:
+        shard_stats = await run_in_threadpool(shard_client.fan_out, "GET", "/stats")
+        answered = [stats for stats in shard_stats if stats is not None]
+        return {
+            "indexed": any(stats.get("indexed") for stats in answered),
+            "total_images": sum(stats.get("total_images", 0) for stats in answered),
+            "photo_library_path": PHOTO_LIBRARY_PATH,
+            "embeddings_bytes": sum(stats.get("embeddings_bytes", 0) for stats in answered),
+            "compressed_bytes": sum(stats.get("compressed_bytes", 0) for stats in answered),
+            "shards_answered": len(answered),
+            "shards": [{"url": url, **(stats or {"error": "unavailable"})} for url, stats in zip(shard_client.urls, shard_stats)]
+        }
     
-    with open(INDEX_FILE, 'r') as f:
-        index_data = json.load(f)
+    index = embedding_index
+    index_data = index_metadata
+    if not index_data:
+        return {"indexed": False, "total_images": 0}
     
     return {
         "indexed": True,
         "total_images": index_data.get("total_images", 0),
-        "photo_library_path": index_data.get("photo_library_path", PHOTO_LIBRARY_PATH)
+        "photo_library_path": index_data.get("photo_library_path", PHOTO_LIBRARY_PATH),
+        "model_name": index_data.get("model_name"),
+        "embedding_dtype": index_data.get("embedding_dtype"),
+        "embeddings_bytes": index.nbytes if index is not None else 0,
+        "compression": index.quantizer.kind if index is not None and index.quantizer is not None else None,
+        "compressed_bytes": int(index.quantizer.codes.nbytes) if index is not None and index.quantizer is not None else 0,
+        "ann_lists": index.ann.n_lists if index is not None and index.ann is not None else None,
+        "catalog": index is not None and index.catalog is not None,
+        "keyword_tokens": len(index.keywords) if index is not None and index.keywords is not None else None,
+        "model_status": model_status,
+        "inference_backend": clip_encoder.name if clip_encoder is not None else None,
+        "inference_accuracy": inference_accuracy,
+        "fast_decode": isinstance(image_preprocess, FastClipPreprocess),
+        "fast_decode_accuracy": fast_decode_accuracy,
+        "text_cache": text_embedding_cache.stats(),
+        "query_batching": query_batcher.stats() if query_batcher is not None else None,
+        "thumbnail_cache": thumbnail_cache.stats()
     }
 
+def resolve_image_path(path: str) -> Path:
+    """Decode a requested image path and make sure it is an existing file inside the photo library"""
+    # Decode the path if it's URL encoded
+    decoded_path = urllib.parse.unquote(path)
+    
+    # Library of the loaded index (kept in memory, so serving an image never re-reads the index files)
+    photo_lib_path = Path(index_metadata.get("photo_library_path", PHOTO_LIBRARY_PATH)).resolve()
+    
+    # Security check: ensure the path is within the photo library
+    image_path = Path(decoded_path).resolve()
+    
+    # Check if path is within photo library or its parent directories
+    # This allows for test_photos directory
+    if not str(image_path).startswith(str(photo_lib_path)) and not str(photo_lib_path) in str(image_path):
+        # Also check if it's in the project directory (for test_photos)
+        project_root = Path(__file__).parent.parent.resolve()
+        if not str(image_path).startswith(str(project_root)):
+            raise HTTPException(status_code=403, detail=f"Access denied. Path: {image_path}, Library: {photo_lib_path}")
+    
+    if not image_path.exists():
+        raise HTTPException(status_code=404, detail=f"Image not found: {image_path}")
+    
+    return image_path
+
 @app.get("/image")
-async def serve_image(path: str):
-    """Serve an image file from the photo library"""
+def serve_image(path: str, size: Optional[int] = None):
+    """Serve an image file from the photo library, or a cached thumbnail if size is given"""
     try:
-        # Decode the path if it's URL encoded
-        decoded_path = urllib.parse.unquote(path)
-        
-        # Get the actual photo library path from index if available
-        photo_lib_path = Path(PHOTO_LIBRARY_PATH).resolve()
-        if os.path.exists(IMAGE_PATHS_FILE):
-            try:
-                with open(IMAGE_PATHS_FILE, 'r') as f:
-                    image_paths = json.load(f)
-                    if image_paths and len(image_paths) > 0:
-                        # Use the directory of the first indexed image as the photo library path
-                        first_image_path = Path(image_paths[0])
-                        photo_lib_path = first_image_path.parent.resolve()
-            except:
-                pass
-        
-        # Security check: ensure the path is within the photo library
-        image_path = Path(decoded_path).resolve()
-        
-        # Check if path is within photo library or its parent directories
-        # This allows for test_photos directory
-        if not str(image_path).startswith(str(photo_lib_path)) and not str(photo_lib_path) in str(image_path):
-            # Also check if it's in the project directory (for test_photos)
-            project_root = Path(__file__).parent.parent.resolve()
-            if not str(image_path).startswith(str(project_root)):
-                raise HTTPException(status_code=403, detail=f"Access denied. Path: {image_path}, Library: {photo_lib_path}")
+        image_path = resolve_image_path(path)
         
-        if not image_path.exists():
-            raise HTTPException(status_code=404, detail=f"Image not found: {image_path}")
+        if size is not None:
+            # Thumbnails are generated lazily on first request and then served from the disk cache
+            thumbnail_path = thumbnail_cache.get(str(image_path), size)
+            return FileResponse(
+                thumbnail_path,
+                media_type=thumbnail_cache.media_type,
+                headers={"Cache-Control": "public, max-age=86400"}
+            )
         
         return FileResponse(image_path, media_type="image/jpeg")
     except HTTPException:
@@ -321,5 +1645,5 @@ async def serve_image(path: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
 
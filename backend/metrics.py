@@ -0,0 +1,238 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond stages up to slow indexing batches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels; observe() is a bisect plus two additions"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(counts), total) for key, (counts, total) in sorted(self._series.items())]
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# A collector returns (name, type, help, [(labels dict, value), ...]) families, computed at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[dict, float]]]]]
+
+
+class Registry:
+    """Metrics exposed by /metrics in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, [labels[n] for n in names])} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "photo_search_http_requests_total", "HTTP requests by method, route and status", ("method", "route", "status")
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "photo_search_http_request_duration_seconds", "HTTP request latency by method and route", ("method", "route")
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "photo_search_stage_duration_seconds",
+    "Time spent in hot-path stages (text_encode, scoring, ranking, result_build, serialization, image_encode, ...)",
+    ("stage",),
+))
+INDEXED_IMAGES = REGISTRY.register(Counter(
+    "photo_search_indexed_images_total", "Images encoded by the indexing pipeline"
+))
+INDEX_FAILURES = REGISTRY.register(Counter(
+    "photo_search_index_failures_total", "Images that could not be decoded while indexing"
+))
+
+
+# (stage, seconds) pairs of the current request, for its Server-Timing header; None outside a request.
+# Worker threads started with run_in_threadpool copy the context, so they append to the same list.
+_stage_timings: ContextVar[Optional[list]] = ContextVar("stage_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Record a stage duration in the histogram and in the current request's timings"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    """Record the duration of a block in the stage histogram and the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect_stage_timings():
+    """Collect the stage timings of a block run outside a request context (e.g. a batch in a worker thread)"""
+    timings = []
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+
+
+def add_stage_timings(timings: List[Tuple[str, float]]):
+    """Attach timings collected elsewhere to the current request (they are already in the histogram)"""
+    current = _stage_timings.get()
+    if current is not None:
+        current.extend(timings)
+
+
+def stage_totals_ms(timings: List[Tuple[str, float]]) -> Dict[str, float]:
+    """Milliseconds per stage, summed over repeats, in first-seen order"""
+    totals: Dict[str, float] = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds * 1000.0
+    return {stage: round(ms, 3) for stage, ms in totals.items()}
+
+
+def current_stage_timings() -> Dict[str, float]:
+    """Stage timings (ms) of the current request so far"""
+    return stage_totals_ms(_stage_timings.get() or [])
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total_seconds: float) -> str:
+    entries = [f"{stage};dur={ms:.3f}" for stage, ms in stage_totals_ms(timings).items()]
+    entries.append(f"total;dur={total_seconds * 1000.0:.3f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware counting requests and timing them per route template
+    (e.g. /image, not /image?path=...), so label cardinality stays bounded.
+    Also collects the request's stage timings and returns them in a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+        timings = []
+        token = _stage_timings.set(timings)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                header = server_timing_header(timings, time.perf_counter() - start)
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _stage_timings.reset(token)
+            route = scope.get("route")
+            route_path: Optional[str] = getattr(route, "path", None) or "unmatched"
+            REQUESTS.inc(method=scope["method"], route=route_path, status=status[0])
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route_path)
@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qs
+
+from starlette.concurrency import run_in_threadpool
+
+
+class StackSampler:
+    """
+    Sampling profiler: snapshots the stacks of all threads every `interval` seconds.
+    Unlike cProfile it also sees the worker threads that run encoding and scoring for async endpoints.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample_count += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Idle threads (waiting on locks, queues, selectors) only add noise
+                if stack and not stack[0].startswith(("wait ", "select ", "_worker ")):
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        """Collapsed-stack format ("frame;frame;frame count"), readable by flamegraph.pl and speedscope"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in per-request profiling: requests with an `X-Profile: 1` header or a `profile=1` query parameter
+    are sampled while they run and the profile is written to profile_dir; its path is returned in an
+    X-Profile-Dump header. Requests without the flag pass straight through.
+
+    The sampler sees every thread of the process, and worker threads are shared between requests, so
+    requests running at the same time show up in the dump too; profile on an otherwise idle server.
+    """
+
+    def __init__(self, app, profile_dir: str = "profiles", interval: float = 0.001):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.interval = interval
+
+    @staticmethod
+    def _finish(sampler: StackSampler, dump_path: str):
+        sampler.stop()
+        sampler.write(dump_path)
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        for name, value in scope.get("headers", []):
+            if name == b"x-profile":
+                return value not in (b"0", b"false", b"")
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        return query.get("profile", ["0"])[0] not in ("0", "false", "")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"].strip("/").replace("/", "_") or "root"
+        dump_path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{route}_{uuid.uuid4().hex[:6]}.folded")
+        sampler = StackSampler(self.interval)
+
+        async def send_with_dump_header(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-dump", dump_path.encode("latin-1"))]}
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_dump_header)
+        finally:
+            # Joining the sampler and writing the dump are blocking, so they run off the event loop
+            await run_in_threadpool(self._finish, sampler, dump_path)
+            print(f"Profile of {scope['path']} ({sampler.sample_count} samples) written to {dump_path}")
@@ -0,0 +1,174 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from ann_index import assign_to_centroids, kmeans
+
+# Rows decoded/scored at a time, to bound temporary float32 memory
+SCORE_CHUNK_ROWS = 65536
+
+
+class ScalarQuantizer:
+    """Per-dimension 8-bit scalar quantization: x ~= offset + scale * code"""
+
+    kind = "sq8"
+
+    def __init__(self, offset: np.ndarray, scale: np.ndarray, codes: np.ndarray):
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.codes = np.asarray(codes, dtype=np.uint8)
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.codes)
+
+    @property
+    def dim(self) -> int:
+        return len(self.offset)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray) -> "ScalarQuantizer":
+        offset = np.full(embeddings.shape[1], np.inf, dtype=np.float32)
+        upper = np.full(embeddings.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(embeddings), SCORE_CHUNK_ROWS):
+            chunk = np.asarray(embeddings[start:start + SCORE_CHUNK_ROWS], dtype=np.float32)
+            offset = np.minimum(offset, chunk.min(axis=0))
+            upper = np.maximum(upper, chunk.max(axis=0))
+        scale = np.maximum(upper - offset, 1e-12) / 255.0
+        quantizer = cls(offset, scale, np.empty((0, embeddings.shape[1]), dtype=np.uint8))
+        quantizer.codes = quantizer.encode(embeddings)
+        return quantizer
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """Codes of the given rows; values outside the trained range are clipped"""
+        codes = np.empty(embeddings.shape, dtype=np.uint8)
+        for start in range(0, len(embeddings), SCORE_CHUNK_ROWS):
+            chunk = np.asarray(embeddings[start:start + SCORE_CHUNK_ROWS], dtype=np.float32)
+            codes[start:start + len(chunk)] = np.clip(np.rint((chunk - self.offset) / self.scale), 0, 255)
+        return codes
+
+    def update(self, kept_rows: np.ndarray, new_embeddings: np.ndarray) -> "ScalarQuantizer":
+        """Codes after an incremental reindex: the kept rows' codes, then the new rows encoded with the same ranges"""
+        return ScalarQuantizer(self.offset, self.scale, np.concatenate([self.codes[kept_rows], self.encode(new_embeddings)]))
+
+    def score(self, query: np.ndarray) -> np.ndarray:
+        """Approximate similarities: x.q = offset.q + code.(scale * q), so the codes are never decoded"""
+        scaled_query = self.scale * query
+        bias = float(self.offset @ query)
+        scores = np.empty(self.n_rows, dtype=np.float32)
+        for start in range(0, self.n_rows, SCORE_CHUNK_ROWS):
+            chunk = self.codes[start:start + SCORE_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = chunk @ scaled_query
+        scores += bias
+        return scores
+
+    def arrays(self) -> dict:
+        return {"offset": self.offset, "scale": self.scale, "codes": self.codes}
+
+
+class ProductQuantizer:
+    """
+    Product quantization: each vector is split into n_subspaces sub-vectors, each replaced by the id of the
+    nearest of 256 sub-centroids. Scoring uses a per-query lookup table of sub-centroid/query dot products.
+    """
+
+    kind = "pq"
+
+    def __init__(self, codebooks: np.ndarray, codes: np.ndarray):
+        # codebooks: (n_subspaces, 256, sub_dim); codes: (N, n_subspaces)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+        self.codes = np.asarray(codes, dtype=np.uint8)
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.codes)
+
+    @property
+    def n_subspaces(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        n_subspaces: int = 64,
+        n_iter: int = 15,
+        sample_size: int = 50000,
+        codebooks: Optional[np.ndarray] = None,
+    ) -> "ProductQuantizer":
+        """Train codebooks and encode all rows; passing existing codebooks skips training"""
+        dim = embeddings.shape[1]
+        if dim % n_subspaces != 0:
+            raise ValueError(f"Embedding dim {dim} is not divisible by {n_subspaces} subspaces")
+        sub_dim = dim // n_subspaces
+
+        train = codebooks is None or codebooks.shape != (n_subspaces, 256, sub_dim)
+        if train:
+            codebooks = np.zeros((n_subspaces, 256, sub_dim), dtype=np.float32)
+        codes = np.empty((len(embeddings), n_subspaces), dtype=np.uint8)
+        for j in range(n_subspaces):
+            sub_vectors = embeddings[:, j * sub_dim:(j + 1) * sub_dim]
+            if train:
+                centroids = kmeans(sub_vectors, 256, n_iter=n_iter, sample_size=sample_size, seed=j, spherical=False)
+                codebooks[j, :len(centroids)] = centroids
+            codes[:, j] = assign_to_centroids(sub_vectors, codebooks[j], euclidean=True)
+        return cls(codebooks, codes)
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """Codes of the given rows with the existing codebooks"""
+        sub_dim = self.codebooks.shape[2]
+        codes = np.empty((len(embeddings), self.n_subspaces), dtype=np.uint8)
+        for j in range(self.n_subspaces):
+            codes[:, j] = assign_to_centroids(embeddings[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j], euclidean=True)
+        return codes
+
+    def update(self, kept_rows: np.ndarray, new_embeddings: np.ndarray) -> "ProductQuantizer":
+        """Codes after an incremental reindex: the kept rows' codes, then the new rows encoded with the same codebooks"""
+        return ProductQuantizer(self.codebooks, np.concatenate([self.codes[kept_rows], self.encode(new_embeddings)]))
+
+    def score(self, query: np.ndarray) -> np.ndarray:
+        """Approximate similarities as a sum of lookup-table entries, one per subspace"""
+        sub_queries = query.reshape(self.n_subspaces, -1)
+        lookup = np.einsum('mkd,md->mk', self.codebooks, sub_queries)
+        subspaces = np.arange(self.n_subspaces)
+        scores = np.empty(self.n_rows, dtype=np.float32)
+        for start in range(0, self.n_rows, SCORE_CHUNK_ROWS):
+            chunk = self.codes[start:start + SCORE_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = lookup[subspaces, chunk].sum(axis=1)
+        return scores
+
+    def arrays(self) -> dict:
+        return {"codebooks": self.codebooks, "codes": self.codes}
+
+
+QUANTIZERS = {ScalarQuantizer.kind: ScalarQuantizer, ProductQuantizer.kind: ProductQuantizer}
+
+
+def save_quantizer(quantizer, path: str):
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, kind=np.array(quantizer.kind), **quantizer.arrays())
+    os.replace(tmp_path, path)
+
+
+def load_quantizer(path: str):
+    """Load a saved ScalarQuantizer or ProductQuantizer, or None if there is none"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files if key != "kind"}
+        return QUANTIZERS[str(data["kind"])](**arrays)
+
+
+def build_quantizer(kind: str, embeddings: np.ndarray, n_subspaces: int = 64, previous=None):
+    """Build codes of the given kind; a previous ProductQuantizer's codebooks are reused if compatible"""
+    if kind == ScalarQuantizer.kind:
+        return ScalarQuantizer.build(embeddings)
+    if kind == ProductQuantizer.kind:
+        codebooks = previous.codebooks if isinstance(previous, ProductQuantizer) else None
+        return ProductQuantizer.build(embeddings, n_subspaces=n_subspaces, codebooks=codebooks)
+    raise ValueError(f"Unknown compression mode: {kind}")
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from typing import Any, Callable, List, Optional
+
+from metrics import add_stage_timings, collect_stage_timings, observe_stage
+
+
+class QueryBatcher:
+    """
+    Dynamic micro-batching for concurrent requests: requests arriving within max_wait_ms of each other
+    (up to max_batch) are handed to process_batch together in a worker thread, and each caller's
+    future is resolved with its own result. While one batch runs, the next one fills up, so the
+    batch size grows with load instead of requests queueing one by one. process_batch may return an
+    exception in place of an item's result to fail that request alone; raising fails the whole batch.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.process_batch = process_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.batches = 0
+        self.requests = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the collector task; must be called from the running event loop"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one request and wait for its result (exceptions from process_batch are re-raised here)"""
+        future = asyncio.get_running_loop().create_future()
+        enqueued = time.perf_counter()
+        await self._queue.put((item, future))
+        result, timings, started = await future
+        # Stages of the shared batch, plus how long this request waited for it to start
+        observe_stage("batch_wait", started - enqueued)
+        add_stage_timings(timings)
+        return result
+
+    async def _collect(self) -> list:
+        """Block for the first request, then take whatever else arrives within max_wait"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            # Requests already waiting are taken without sleeping
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            remaining = deadline - loop.time()
+            if len(batch) >= self.max_batch or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Callers that went away (e.g. client disconnects) are dropped before doing any work
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                results, timings, started = await loop.run_in_executor(None, self._process, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result((result, timings, started))
+
+    def _process(self, items: List[Any]):
+        """Run process_batch in a worker thread, collecting its stage timings for every request in the batch"""
+        started = time.perf_counter()
+        with collect_stage_timings() as timings:
+            results = self.process_batch(items)
+        return results, timings, started
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
@@ -0,0 +1,140 @@
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from metrics import observe_stage
+
+
+# Stages whose progress counts encoded images; their rate is kept as the job's encoding throughput
+ENCODING_STAGES = ("scanning+encoding", "encoding")
+
+
+class ReindexCancelled(Exception):
+    """Raised inside index_images when the running job has been cancelled"""
+
+
+class ReindexJob:
+    """A reindex running in a background thread, with progress and cancellation"""
+
+    def __init__(self, full: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.full = full
+        self.status = "pending"  # pending, running, completed, cancelled, failed
+        self.stage = "queued"
+        self.total = 0
+        self.processed = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._progress_started_at: Optional[float] = None
+        # Images per second of the encoding stages, frozen when they end (later stages reset the rate)
+        self.encode_rate: Optional[float] = None
+        # True while the total still grows (files are encoded while the scan is still finding them)
+        self.total_growing = False
+        # Seconds spent per stage (scanning, checking, encoding, saving, ...)
+        self.stage_seconds: Dict[str, float] = {}
+        self._stage_started_at: Optional[float] = None
+        self._cancel_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def start(self, target: Callable[["ReindexJob"], None]):
+        """Run target(job) in a daemon thread"""
+        self._thread = threading.Thread(target=self._run, args=(target,), name=f"reindex-{self.id}", daemon=True)
+        self._thread.start()
+
+    def _run(self, target: Callable[["ReindexJob"], None]):
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            target(self)
+            self.status = "completed"
+        except ReindexCancelled:
+            self.status = "cancelled"
+            print(f"Reindex job {self.id} cancelled")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"Reindex job {self.id} failed: {e}")
+        finally:
+            self._finish_stage()
+            self.stage = "done"
+            self.finished_at = time.time()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise ReindexCancelled()
+
+    def _progress_rate(self) -> Optional[float]:
+        """Items per second since the current progress total was set"""
+        if self._progress_started_at is None or self.processed <= 0:
+            return None
+        end = self.finished_at or time.time()
+        return self.processed / max(end - self._progress_started_at, 1e-6)
+
+    def _finish_stage(self):
+        if self.stage in ENCODING_STAGES:
+            self.encode_rate = self._progress_rate()
+        if self._stage_started_at is not None:
+            seconds = time.perf_counter() - self._stage_started_at
+            self.stage_seconds[self.stage] = self.stage_seconds.get(self.stage, 0.0) + seconds
+            observe_stage(f"reindex_{self.stage}", seconds)
+            self._stage_started_at = None
+
+    def set_stage(self, stage: str, total: Optional[int] = None, total_growing: bool = False):
+        """Start a stage; a total resets progress, total_growing marks it as still growing (no ETA yet)"""
+        self.check_cancelled()
+        self._finish_stage()
+        self.stage = stage
+        self._stage_started_at = time.perf_counter()
+        if total is not None:
+            self.total = total
+            self.processed = 0
+            self.total_growing = total_growing
+            self._progress_started_at = time.time()
+
+    def continue_stage(self, stage: str):
+        """
+        Rename the running stage, keeping its progress and fixing its total (e.g. the scan finished and
+        the rest is encoding). Never raises, so it is safe from producer threads of the pipeline.
+        """
+        self._finish_stage()
+        self.stage = stage
+        self._stage_started_at = time.perf_counter()
+        self.total_growing = False
+
+    def advance(self, count: int):
+        self.processed += count
+        self.check_cancelled()
+
+    def to_dict(self) -> dict:
+        rate = self._progress_rate()
+        eta_seconds = None
+        if rate is not None and self.is_active and not self.total_growing:
+            eta_seconds = max(self.total - self.processed, 0) / rate
+        encode_rate = rate if self.stage in ENCODING_STAGES else self.encode_rate
+
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "full": self.full,
+            "processed": self.processed,
+            "total": self.total,
+            "total_growing": self.total_growing,
+            "rate": round(rate, 2) if rate is not None else None,
+            "eta_seconds": round(eta_seconds, 1) if eta_seconds is not None else None,
+            "encode_rate": round(encode_rate, 2) if encode_rate is not None else None,
+            "stage_seconds": {stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()},
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
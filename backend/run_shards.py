@@ -0,0 +1,46 @@
+"""
+Run a sharded backend on one machine: N shard processes (each indexing its share of the library)
+plus a coordinator on the main port that fans searches out to them.
+
+    python run_shards.py --shards 4 --port 8000
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Launch shard backends and a coordinator")
+    parser.add_argument("--shards", type=int, default=2, help="Number of shard processes")
+    parser.add_argument("--port", type=int, default=8000, help="Coordinator port; shards use the following ports")
+    parser.add_argument("--by", choices=["hash", "directory"], default=os.getenv("SHARD_BY", "hash"),
+                        help="Split the library by path hash or by top-level folder")
+    args = parser.parse_args()
+
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    shard_urls = []
+    processes = []
+    for shard_id in range(args.shards):
+        port = args.port + 1 + shard_id
+        env = dict(os.environ, SHARD_COUNT=str(args.shards), SHARD_ID=str(shard_id), SHARD_BY=args.by, PORT=str(port))
+        env.pop("SHARD_URLS", None)
+        processes.append(subprocess.Popen([sys.executable, main_py], env=env))
+        shard_urls.append(f"http://127.0.0.1:{port}")
+
+    env = dict(os.environ, SHARD_URLS=",".join(shard_urls), PORT=str(args.port))
+    processes.append(subprocess.Popen([sys.executable, main_py], env=env))
+    print(f"Coordinator on port {args.port}, shards: {', '.join(shard_urls)}")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import heapq
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
+
+import requests
+
+from metrics import timed
+
+
+def shard_for_path(path: str, shard_count: int, library_root: str, by: str = "hash") -> int:
+    """
+    Shard that owns an image: by a stable hash of the full path, or with by="directory"
+    by the hash of its top-level folder inside the library (keeps albums together)
+    """
+    key = path
+    if by == "directory":
+        relative = os.path.relpath(path, library_root)
+        key = relative.split(os.sep, 1)[0] if os.sep in relative else ""
+    return zlib.crc32(key.encode("utf-8")) % shard_count
+
+
+class ShardClient:
+    """Scatter-gather client for shard backends; slow or unreachable shards are skipped after a timeout"""
+
+    def __init__(self, urls: List[str], timeout: float = 5.0):
+        self.urls = [url.rstrip("/") for url in urls]
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.trust_env = False  # shards are local/internal: never go through a proxy
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, len(self.urls) * 4))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max(4, len(self.urls) * 4), thread_name_prefix="shard")
+
+    def _call(self, url: str, method: str, endpoint: str, **kwargs):
+        response = self.session.request(method, f"{url}{endpoint}", timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def fan_out(self, method: str, endpoint: str, **kwargs) -> List[Optional[object]]:
+        """Send the same request to every shard; returns one JSON body per shard, None where it failed"""
+        with timed("shard_fanout"):
+            futures = [self.executor.submit(self._call, url, method, endpoint, **kwargs) for url in self.urls]
+            # Overall deadline, so a hung shard cannot hold the query past the timeout
+            wait(futures, timeout=self.timeout)
+
+        results = []
+        for url, future in zip(self.urls, futures):
+            if not future.done():
+                print(f"⚠️  Shard {url} timed out on {endpoint}")
+                future.cancel()
+                results.append(None)
+            elif future.exception() is not None:
+                print(f"⚠️  Shard {url} failed on {endpoint}: {future.exception()}")
+                results.append(None)
+            else:
+                results.append(future.result())
+        return results
+
+
+def merge_top_k(shard_results: List[Optional[list]], limit: int, threshold: Optional[float] = None) -> Tuple[list, int]:
+    """
+    Merge per-shard result lists ({path, score} dicts) into a global top-k by score.
+    Returns (results, number of shards that answered). As with a single index, a threshold that
+    nothing passes still returns the single best result.
+    """
+    answered = [results for results in shard_results if results is not None]
+    merged = heapq.nlargest(limit, (item for results in answered for item in results), key=lambda item: item["score"])
+    if threshold is not None:
+        passing = [item for item in merged if item["score"] >= threshold]
+        merged = passing if passing else merged[:1]
+    return merged, len(answered)
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for a query: CLIP's tokenizer lowercases and collapses whitespace, so we do too"""
+    return " ".join(query.lower().split())
+
+
+class TextEmbeddingCache:
+    """Bounded LRU cache of normalized text query embeddings, tied to the model that produced them"""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.model_key: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_model(self, model_key: str):
+        """Drop all entries if embeddings now come from a different model"""
+        with self._lock:
+            if model_key != self.model_key:
+                self._entries.clear()
+                self.model_key = model_key
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query: str, embedding: np.ndarray):
+        if self.max_size <= 0:
+            return
+        embedding = np.array(embedding, dtype=np.float32)
+        # Shared between requests, so make sure nobody modifies it in place
+        embedding.setflags(write=False)
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
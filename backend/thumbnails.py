@@ -0,0 +1,143 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Tuple
+
+from PIL import Image, features
+
+# Requested sizes are rounded up to one of these buckets (longest side, in pixels)
+THUMBNAIL_SIZES = (128, 256, 512, 1024)
+
+
+def bucket_size(size: int) -> int:
+    """Smallest bucket that is at least `size`, or the largest bucket"""
+    for bucket in THUMBNAIL_SIZES:
+        if size <= bucket:
+            return bucket
+    return THUMBNAIL_SIZES[-1]
+
+
+class ThumbnailCache:
+    """On-disk cache of size-bucketed thumbnails with a byte budget and least-recently-used eviction"""
+
+    def __init__(self, cache_dir: str, max_bytes: int, quality: int = 80):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.format = "WEBP" if features.check("webp") else "JPEG"
+        self.media_type = "image/webp" if self.format == "WEBP" else "image/jpeg"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _entries(self) -> Iterable[Tuple[str, int, float]]:
+        """(path, size, last use) of every cached thumbnail"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def cache_path(self, image_path: str, size: int) -> str:
+        # Keyed on the source mtime so edited photos get a fresh thumbnail
+        mtime_ns = os.stat(image_path).st_mtime_ns
+        key = hashlib.sha1(f"{image_path}|{mtime_ns}|{size}|{self.quality}".encode("utf-8")).hexdigest()
+        extension = "webp" if self.format == "WEBP" else "jpg"
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{extension}")
+
+    def get(self, image_path: str, size: int) -> str:
+        """Path of the cached thumbnail for an image, generating it on first request"""
+        size = bucket_size(size)
+        thumbnail_path = self.cache_path(image_path, size)
+        if os.path.exists(thumbnail_path):
+            with self._lock:
+                self.hits += 1
+            try:
+                # Mark as recently used for eviction
+                os.utime(thumbnail_path)
+            except OSError:
+                pass
+            return thumbnail_path
+
+        with self._lock:
+            self.misses += 1
+        self._generate(image_path, size, thumbnail_path)
+        return thumbnail_path
+
+    def _generate(self, image_path: str, size: int, thumbnail_path: str):
+        image = Image.open(image_path)
+        # Let JPEG decode at a reduced scale instead of full resolution
+        image.draft('RGB', (size, size))
+        image = image.convert('RGB')
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        tmp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, self.format, quality=self.quality)
+        os.replace(tmp_path, thumbnail_path)
+
+        with self._lock:
+            self._total_bytes += os.path.getsize(thumbnail_path)
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used thumbnails until the cache is under 90% of its budget"""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total_bytes = total
+
+    def pregenerate(
+        self,
+        image_paths: Iterable[str],
+        size: int,
+        num_workers: int = 4,
+        on_progress: Optional[Callable[[int], None]] = None,
+    ):
+        """
+        Generate thumbnails ahead of time (e.g. right after indexing). on_progress(1) is called per image;
+        if it raises (e.g. a cancelled reindex job), the thumbnails not yet started are skipped.
+        """
+        def generate(image_path: str):
+            try:
+                self.get(image_path, size)
+            except Exception as e:
+                print(f"Error generating thumbnail for {image_path}: {e}")
+
+        # PIL releases the GIL while decoding and resizing, so threads are enough here
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+        try:
+            for _ in executor.map(generate, image_paths):
+                if on_progress is not None:
+                    on_progress(1)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "format": self.format,
+            }
@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 from PIL import Image
 import io
+from concurrent.futures import ThreadPoolExecutor
 
 # Disable proxy for requests to avoid SOCKS connection issues
 os.environ.pop('ALL_PROXY', None)
@@ -20,6 +21,10 @@ st.set_page_config(
 
 # API configuration
 API_BASE = os.getenv("API_BASE", "http://localhost:8000")
+# Longest side of result-list thumbnails; the full image is only fetched for the large preview
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "512"))
+# Concurrent image downloads when rendering results
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", "8"))
 
 # Custom CSS for better styling
 st.markdown("""
@@ -93,6 +98,8 @@ if 'selected_image' not in st.session_state:
     st.session_state.selected_image = None
 if 'search_results' not in st.session_state:
     st.session_state.search_results = []
+if 'reindex_job_id' not in st.session_state:
+    st.session_state.reindex_job_id = None
 
 def get_stats():
     """Get indexing statistics from backend"""
@@ -114,14 +121,30 @@ def get_stats():
     except Exception as e:
         return None
 
-def search_images(query, limit, threshold, use_threshold):
-    """Search for images"""
+def get_reindex_status(job_id):
+    """Get progress of a background reindex job"""
+    try:
+        response = requests.get(
+            f"{API_BASE}/reindex/status",
+            params={"job_id": job_id},
+            timeout=5,
+            proxies={'http': None, 'https': None}
+        )
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except Exception:
+        return None
+
+def search_images(query, limit, threshold, use_threshold, filters=None):
+    """Search for images, optionally restricted by metadata filters (date range, folder, camera)"""
     try:
         payload = {
             "query": query,
             "limit": limit,
             "threshold": threshold,
-            "use_threshold": use_threshold
+            "use_threshold": use_threshold,
+            **(filters or {})
         }
         response = requests.post(
             f"{API_BASE}/search",
@@ -132,6 +155,9 @@ def search_images(query, limit, threshold, use_threshold):
         )
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 503:
+            st.warning("⏳ 后端正在加载模型，请稍后再试")
+            return []
         else:
             st.error(f"搜索失败 (状态码: {response.status_code}): {response.text[:200]}")
             return []
@@ -148,10 +174,69 @@ def search_images(query, limit, threshold, use_threshold):
         st.error(f"❌ 搜索错误: {str(e)[:200]}")
         return []
 
-def get_image_url(image_path):
-    """Get image URL from backend"""
+def search_similar(image_path, limit, threshold, use_threshold):
+    """Find images similar to an indexed image"""
+    try:
+        response = requests.post(
+            f"{API_BASE}/search/similar",
+            data={
+                "path": image_path,
+                "limit": limit,
+                "threshold": threshold,
+                "use_threshold": use_threshold
+            },
+            timeout=60,
+            proxies={'http': None, 'https': None}  # Disable proxy for local connections
+        )
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"相似图片搜索失败 (状态码: {response.status_code}): {response.text[:200]}")
+            return []
+    except requests.exceptions.ConnectionError:
+        st.error("❌ 无法连接到后端服务器。请确保后端正在运行 (http://localhost:8000)")
+        return []
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ 网络错误: {str(e)[:200]}")
+        return []
+
+def get_image_url(image_path, size=None):
+    """Get image URL from backend (a cached thumbnail if size is given)"""
     encoded_path = requests.utils.quote(image_path, safe='')
-    return f"{API_BASE}/image?path={encoded_path}"
+    url = f"{API_BASE}/image?path={encoded_path}"
+    if size is not None:
+        url += f"&size={size}"
+    return url
+
+@st.cache_resource
+def get_http_session():
+    """Shared keep-alive session for image downloads, with one pooled connection per worker"""
+    session = requests.Session()
+    session.trust_env = False  # Disable proxy for local connections
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=IMAGE_FETCH_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_image(url):
+    """Download and decode one image; returns (status_code, image or None)"""
+    response = get_http_session().get(url, timeout=15)
+    if response.status_code != 200:
+        return response.status_code, None
+    img = Image.open(io.BytesIO(response.content))
+    img.load()
+    return response.status_code, img
+
+def fetch_images(urls):
+    """Download images concurrently; each entry is (status_code, image) or the exception that was raised"""
+    def fetch(url):
+        try:
+            return fetch_image(url)
+        except Exception as e:
+            return e
+    
+    with ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS) as executor:
+        return list(executor.map(fetch, urls))
 
 # Header
 st.markdown('<h1 class="main-header">🔍 AI 照片搜索</h1>', unsafe_allow_html=True)
@@ -171,6 +256,13 @@ with st.sidebar:
         )
         if health_response.status_code == 200:
             st.success("✅ 后端已连接")
+            ready_response = requests.get(
+                f"{API_BASE}/ready",
+                timeout=5,
+                proxies={'http': None, 'https': None}
+            )
+            if ready_response.status_code == 503:
+                st.info("⏳ 模型加载中，索引更新后即可搜索")
         else:
             st.error(f"❌ 后端响应异常 (状态码: {health_response.status_code})")
             st.info("请检查后端服务器状态")
@@ -215,24 +307,75 @@ with st.sidebar:
         help="相似度分数低于此值的图片将被过滤"
     )
     
+    # Metadata filters: only matching photos are scored by the backend
+    search_filters = {}
+    if st.checkbox("关键词混合搜索", value=True, help="同时匹配文件夹名、文件名和说明文字（如旅行或活动名称）"):
+        search_filters["mode"] = "hybrid"
+    with st.expander("🗂️ 筛选条件"):
+        folder_filter = st.text_input("文件夹", placeholder="例如 2023/京都旅行", help="相对于图库的路径前缀")
+        camera_filter = st.text_input("相机", placeholder="例如 Canon EOS R5")
+        use_date_filter = st.checkbox("按拍摄日期筛选", value=False)
+        date_range = st.date_input("拍摄日期范围", value=[], disabled=not use_date_filter)
+        if folder_filter.strip():
+            search_filters["folder"] = folder_filter.strip()
+        if camera_filter.strip():
+            search_filters["camera"] = camera_filter.strip()
+        if use_date_filter and date_range:
+            search_filters["taken_after"] = date_range[0].isoformat()
+            search_filters["taken_before"] = date_range[-1].isoformat()
+    
     st.divider()
     
-    # Reindex button
+    # Reindex button (runs in the background on the server)
     if st.button("🔄 重新索引", use_container_width=True):
-        with st.spinner("正在重新索引..."):
-            try:
-                response = requests.post(
-                    f"{API_BASE}/reindex", 
-                    timeout=300,
-                    proxies={'http': None, 'https': None}  # Disable proxy for local connections
-                )
-                if response.status_code == 200:
-                    st.success("重新索引完成！")
+        try:
+            response = requests.post(
+                f"{API_BASE}/reindex", 
+                timeout=10,
+                proxies={'http': None, 'https': None}  # Disable proxy for local connections
+            )
+            if response.status_code == 200:
+                st.session_state.reindex_job_id = response.json().get("job_id")
+            else:
+                st.error("重新索引失败")
+        except Exception as e:
+            st.error(f"重新索引错误: {e}")
+    
+    # Reindex progress
+    job_status = get_reindex_status(st.session_state.reindex_job_id) if st.session_state.reindex_job_id else None
+    if job_status:
+        status = job_status.get("status")
+        total = job_status.get("total") or 0
+        processed = job_status.get("processed") or 0
+        if status in ("pending", "running"):
+            progress_text = f"{job_status.get('stage')}: {processed}/{total}"
+            if job_status.get("rate"):
+                progress_text += f" • {job_status['rate']:.1f} 张/秒"
+            if job_status.get("eta_seconds") is not None:
+                progress_text += f" • 剩余约 {job_status['eta_seconds']:.0f} 秒"
+            st.progress(min(processed / total, 1.0) if total else 0.0, text=progress_text)
+            col_refresh, col_cancel = st.columns(2)
+            with col_refresh:
+                if st.button("🔃 刷新", key="reindex_refresh", use_container_width=True):
                     st.rerun()
-                else:
-                    st.error("重新索引失败")
-            except Exception as e:
-                st.error(f"重新索引错误: {e}")
+            with col_cancel:
+                if st.button("⏹️ 取消", key="reindex_cancel", use_container_width=True):
+                    try:
+                        requests.post(
+                            f"{API_BASE}/reindex/cancel",
+                            params={"job_id": job_status.get("job_id")},
+                            timeout=10,
+                            proxies={'http': None, 'https': None}
+                        )
+                    except Exception as e:
+                        st.error(f"取消失败: {e}")
+                    st.rerun()
+        elif status == "completed":
+            st.success("重新索引完成！")
+        elif status == "cancelled":
+            st.warning("重新索引已取消")
+        elif status == "failed":
+            st.error(f"重新索引失败: {job_status.get('error')}")
 
 # Main content area - Use form to enable Enter key submission
 with st.form("search_form", clear_on_submit=False):
@@ -252,7 +395,7 @@ with st.form("search_form", clear_on_submit=False):
     # Search and display results (triggered by button click or Enter key)
     if search_button and search_query:
         with st.spinner("正在搜索..."):
-            results = search_images(search_query, limit, threshold, use_threshold)
+            results = search_images(search_query, limit, threshold, use_threshold, search_filters)
             st.session_state.search_results = results
             st.session_state.selected_image = None  # Clear selected image on new search
 
@@ -261,6 +404,12 @@ if st.session_state.search_results:
     st.divider()
     st.subheader(f"📸 找到 {len(st.session_state.search_results)} 张相关图片")
     
+    # Fetch all thumbnails concurrently before rendering
+    fetched_thumbnails = fetch_images([
+        get_image_url(result['path'], size=THUMBNAIL_SIZE)
+        for result in st.session_state.search_results
+    ])
+    
     # Display results as a list
     for idx, result in enumerate(st.session_state.search_results):
         image_url = get_image_url(result['path'])
@@ -276,14 +425,11 @@ if st.session_state.search_results:
             with col_img:
                 # Display thumbnail image
                 try:
-                    img_response = requests.get(
-                        image_url, 
-                        timeout=15,
-                        proxies={'http': None, 'https': None}
-                    )
-                    if img_response.status_code == 200:
-                        img = Image.open(io.BytesIO(img_response.content))
-                        
+                    fetched = fetched_thumbnails[idx]
+                    if isinstance(fetched, Exception):
+                        raise fetched
+                    status_code, img = fetched
+                    if status_code == 200:
                         # Display thumbnail - click to view full size
                         st.image(img, use_container_width=True)
                         
@@ -296,7 +442,7 @@ if st.session_state.search_results:
                             }
                             st.rerun()
                     else:
-                        st.error(f"图片加载失败 (状态码: {img_response.status_code})")
+                        st.error(f"图片加载失败 (状态码: {status_code})")
                         st.text(f"URL: {image_url}")
                         st.text(f"路径: {result['path']}")
                 except requests.exceptions.RequestException as e:
@@ -318,6 +464,13 @@ if st.session_state.search_results:
                 with st.expander("📁 查看完整路径"):
                     st.code(result['path'], language=None)
                 
+                # Find more photos like this one
+                if st.button("🔎 相似图片", key=f"similar_{idx}"):
+                    with st.spinner("正在搜索相似图片..."):
+                        st.session_state.search_results = search_similar(result['path'], limit, threshold, use_threshold)
+                        st.session_state.selected_image = None
+                        st.rerun()
+                
                 # Additional info
                 st.caption(f"结果 #{idx + 1} / {len(st.session_state.search_results)}")
             
@@ -333,14 +486,8 @@ if st.session_state.selected_image:
     st.subheader("🖼️ 大图预览")
     
     try:
-        img_response = requests.get(
-            selected['url'], 
-            timeout=15,
-            proxies={'http': None, 'https': None}  # Disable proxy for local connections
-        )
-        if img_response.status_code == 200:
-            img = Image.open(io.BytesIO(img_response.content))
-            
+        status_code, img = fetch_image(selected['url'])
+        if status_code == 200:
             # Display image in large size
             col1, col2, col3 = st.columns([1, 6, 1])
             with col2:
@@ -354,7 +501,7 @@ if st.session_state.selected_image:
                     st.session_state.selected_image = None
                     st.rerun()
         else:
-            st.error(f"无法加载大图 (状态码: {img_response.status_code})")
+            st.error(f"无法加载大图 (状态码: {status_code})")
             if st.button("❌ 关闭", key="close_error", use_container_width=True):
                 st.session_state.selected_image = None
                 st.rerun()
@@ -395,7 +542,7 @@ if not st.session_state.search_results:
             if st.button(query, key=f"example_{idx}", use_container_width=True):
                 # Directly trigger search with example query
                 with st.spinner("正在搜索..."):
-                    results = search_images(query, limit, threshold, use_threshold)
+                    results = search_images(query, limit, threshold, use_threshold, search_filters)
                     st.session_state.search_results = results
                     st.session_state.selected_image = None
                     st.rerun()